@@ -1,40 +1,60 @@
 import base64
+import csv
+import gzip
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import json
 from datetime import datetime, timedelta
-from email.header import Header
 from functools import lru_cache
+import io
 import os
-import random
-import secrets
-import string
-from smtplib import SMTPSenderRefused
-import traceback
+import re
+import threading
+import zlib
+import time
 from typing import List, Optional, cast
 from flask import (
     Flask,
+    Request,
+    Response,
+    after_this_request,
+    g,
+    has_request_context,
     make_response,
     redirect,
     request,
     jsonify,
     render_template,
+    stream_with_context,
     url_for,
 )
 from flask_sqlalchemy import SQLAlchemy
 from flasgger import Swagger
 from flask_cors import CORS
-from requests import HTTPError
 import serpapi
 import yaml
-from sqlalchemy.orm import Mapper
-from sqlalchemy import inspect
+import click
+from sqlalchemy import (
+    bindparam,
+    case,
+    event,
+    func,
+    insert,
+    inspect,
+    literal_column,
+    text,
+    tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from flask_mail import Mail, Message
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder
+from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 import smtplib, ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from email.message import EmailMessage
-from email.policy import SMTP
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
@@ -45,8 +65,42 @@ from flask_jwt_extended import (
 
 # Für den neuen 2.0-Stil
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import defer, joinedload, load_only, noload, selectinload
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Ohne Pillow werden keine Thumbnails erzeugt
+    Image = None
+
+
+class LimitedRequest(Request):
+    """Request mit Body-Limit pro Endpoint.
+
+    Werkzeug bricht beim Lesen ab, sobald das Limit überschritten ist (auch
+    bei chunked Requests ohne Content-Length), statt den Body erst komplett
+    zu puffern. Bild-Uploads sind enger begrenzt, der NDJSON-Import liest
+    zeilenweise und ist nicht begrenzt.
+    """
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == "import_items":
+            return None
+        if self.endpoint in IMAGE_UPLOAD_ENDPOINTS:
+            return MAX_IMAGE_SIZE + MULTIPART_OVERHEAD
+        return super().max_content_length
+
+    def get_data(self, *args, **kwargs):
+        # Ohne Content-Length kürzt Werkzeug beim Lesen am Limit stillschweigend
+        data = super().get_data(*args, **kwargs)
+        limit = self.max_content_length
+        if limit is not None and self.content_length is None and len(data) >= limit:
+            raise RequestEntityTooLarge()
+        return data
+
 
 app = Flask(__name__)
+app.request_class = LimitedRequest
 
 
 # Intelligente Database URI Konfiguration
@@ -101,6 +155,7 @@ app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "TeStK3y123!")
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = False  # 15 Minuten
 app.config["JWT_REFRESH_TOKEN_EXPIRES"] = 604800  # 7 Tage
+app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10MB
 app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
 app.config["MAIL_PORT"] = os.getenv("MAIL_PORT", 465)
 app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
@@ -160,6 +215,11 @@ def method_not_allowed(error):
     return jsonify({"error": "Method Not Allowed"}), 405
 
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({"error": "Request too large"}), 413
+
+
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -189,8 +249,10 @@ def handle_exception(e):
 @app.before_request
 def before_request():
     """Request preprocessing - kann für Timeouts und Limits verwendet werden"""
-    # Set maximum request size (10MB)
-    if request.content_length and request.content_length > 10 * 1024 * 1024:
+    # Zu große Requests mit Content-Length sofort ablehnen, ohne Body zu lesen;
+    # Limits pro Endpoint siehe LimitedRequest
+    limit = request.max_content_length
+    if limit is not None and request.content_length and request.content_length > limit:
         return jsonify({"error": "Request too large"}), 413
 
 
@@ -234,7 +296,7 @@ class User(db.Model):
             "id": self.id,
             "username": self.username,
             "email": self.email,
-            "image": self.image,
+            "image": media_url(self.image),
             "admin": self.admin,
             "persons": self.persons,
             "activated": self.activated,
@@ -351,15 +413,73 @@ class GroupInvitation(db.Model):
         return secrets.token_urlsafe(32)
 
 
+# Zuordnung Item <-> Kategorie; "position" erhält die Reihenfolge der Eingabe
+storage_item_category = db.Table(
+    "storage_item_category",
+    db.Column(
+        "storage_item_id",
+        db.Integer,
+        db.ForeignKey("storage_item.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column(
+        "category_id",
+        db.Integer,
+        db.ForeignKey("category.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column("position", db.Integer, nullable=False, default=0),
+    db.Index("ix_storage_item_category_category", "category_id", "storage_item_id"),
+)
+
+basket_item_category = db.Table(
+    "basket_item_category",
+    db.Column(
+        "basket_item_id",
+        db.Integer,
+        db.ForeignKey("basket_item.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column(
+        "category_id",
+        db.Integer,
+        db.ForeignKey("category.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column("position", db.Integer, nullable=False, default=0),
+    db.Index("ix_basket_item_category_category", "category_id", "basket_item_id"),
+)
+
+
+def item_name_key(name: str) -> str:
+    """Vergleichsschlüssel für Namen ohne Groß-/Kleinschreibung (auch Umlaute)"""
+    return name.strip().casefold()
+
+
+def _default_name_key(context) -> str:
+    return item_name_key(context.get_current_parameters()["name"])
+
+
 class StorageItem(db.Model):
     __tablename__ = "storage_item"
     id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
     name: Mapped[str] = mapped_column(db.String(100), nullable=False)
+    # item_name_key(name), auch bei Core-Inserts gesetzt; Abgleich im Checkout
+    name_key: Mapped[Optional[str]] = mapped_column(
+        db.String(100), default=_default_name_key
+    )
     amount: Mapped[int] = mapped_column(db.Integer, nullable=False)
     user_id: Mapped[int] = mapped_column(
         db.Integer, db.ForeignKey("user.id"), nullable=False
     )
+    # Kommagetrennte Kopie der Kategorien, nur noch für den Volltextindex
     categories: Mapped[Optional[str]] = mapped_column(db.String(500))
+    linked_categories: Mapped[List["Category"]] = relationship(
+        "Category",
+        secondary=storage_item_category,
+        order_by=storage_item_category.c.position,
+        viewonly=True,
+    )
     lowestAmount: Mapped[int] = mapped_column(db.Integer, nullable=False)
     midAmount: Mapped[int] = mapped_column(db.Integer, nullable=False)
     unit: Mapped[str] = mapped_column(db.String(50), nullable=False)
@@ -380,6 +500,14 @@ class StorageItem(db.Model):
             "user_id",
             name="unique_name_location_unit_user",
         ),
+        # Keyset-Pagination: (user_id, id) und (name, id)
+        db.Index("ix_storage_item_user_id_id", "user_id", "id"),
+        db.Index("ix_storage_item_name_id", "name", "id"),
+        db.Index("ix_storage_item_user_name_key", "user_id", "name_key"),
+        # Bestandsstatus: deckt Filter auf user_id und den CASE-Ausdruck ab
+        db.Index(
+            "ix_storage_item_stock", "user_id", "amount", "lowestAmount", "midAmount"
+        ),
     )
 
     def __init__(
@@ -418,7 +546,20 @@ class BasketItem(db.Model):
     name: Mapped[str] = mapped_column(db.String(100), nullable=False)
     amount: Mapped[int] = mapped_column(db.Integer, nullable=True)
     categories: Mapped[Optional[str]] = mapped_column(db.String(500))
+    linked_categories: Mapped[List["Category"]] = relationship(
+        "Category",
+        secondary=basket_item_category,
+        order_by=basket_item_category.c.position,
+        viewonly=True,
+    )
     icon: Mapped[Optional[str]] = mapped_column(db.String(200))
+    __table_args__ = (
+        # Keyset-Pagination: (user_id, id) und (name, id)
+        db.Index("ix_basket_item_user_id_id", "user_id", "id"),
+        db.Index("ix_basket_item_name_id", "name", "id"),
+        # Ein Eintrag pro Name und User, Ziel des Insert-or-increment
+        db.Index("uq_basket_item_name_user", "name", "user_id", unique=True),
+    )
 
     def __init__(
         self, name: str, amount: int, categories: str, icon: str, user_id: int
@@ -574,309 +715,2540 @@ class NutrientUnit(db.Model):
         self.user_id = user_id
 
 
-def get_user_group_ids(user_id):
-    """Hilfsfunktion: Gibt alle Gruppen-IDs zurück, in denen der User Mitglied ist"""
-    user_groups = UserGroup.query.filter_by(user_id=user_id).all()
-    return [ug.group_id for ug in user_groups]
+class DataVersion(db.Model):
+    """Monoton steigender Versionszähler pro User.
 
+    Jede schreibende Route erhöht den Zähler des Users, dessen Daten sich
+    geändert haben. Die ETags der Listen-Endpunkte werden aus den Zählern
+    aller sichtbaren User gebildet.
+    """
 
-def get_group_member_ids(user_id):
-    """Hilfsfunktion: Gibt alle User-IDs zurück, die in den gleichen Gruppen sind wie der aktuelle User"""
-    group_ids = get_user_group_ids(user_id)
-    if not group_ids:
-        return [user_id]  # Nur der User selbst
+    __tablename__ = "data_version"
+    user_id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
 
-    # Alle User in den gleichen Gruppen finden
-    group_members = UserGroup.query.filter(UserGroup.group_id.in_(group_ids)).all()
-    member_ids = list(set([gm.user_id for gm in group_members]))  # Duplikate entfernen
+    def __init__(self, user_id: int, version: int = 0):
+        self.user_id = user_id
+        self.version = version
 
-    # Den aktuellen User immer hinzufügen
-    if user_id not in member_ids:
-        member_ids.append(user_id)
 
-    return member_ids
+class NameTrigram(db.Model):
+    """Vorberechnete Trigramme der Namen von StorageItems und BasketItems.
 
+    Grundlage der unscharfen Suche; ``total`` ist die Anzahl der Trigramme
+    des ganzen Namens und wird für die Ähnlichkeit benötigt.
+    """
 
-def generate_token(email: str, salt: str) -> str:
-    ts = URLSafeTimedSerializer(app.config["SECRET_KEY"])
-    return ts.dumps(email, salt=salt)
+    __tablename__ = "name_trigram"
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(db.String(10), nullable=False)  # item, basket
+    ref_id: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    trigram: Mapped[str] = mapped_column(db.String(3), nullable=False)
+    total: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    __table_args__ = (
+        db.Index("ix_name_trigram_lookup", "kind", "trigram", "ref_id"),
+        db.Index("ix_name_trigram_ref", "kind", "ref_id"),
+    )
 
+    def __init__(self, kind: str, ref_id: int, trigram: str, total: int):
+        self.kind = kind
+        self.ref_id = ref_id
+        self.trigram = trigram
+        self.total = total
 
-def confirm_token(token: str, salt: str, expiration=3600) -> str:
-    ts = URLSafeTimedSerializer(app.config["SECRET_KEY"])
-    return ts.loads(token, salt=salt, max_age=expiration)
 
+class ChangeLog(db.Model):
+    """Append-only Änderungsprotokoll für den Delta-Sync.
 
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+    Jede schreibende Route hängt pro geändertem Item einen Eintrag mit
+    monoton steigender ``seq`` an; Löschungen werden als Tombstone
+    (``op = "delete"``) protokolliert.
+    """
 
+    __tablename__ = "change_log"
+    seq: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(db.Integer, nullable=False)  # Besitzer
+    entity: Mapped[str] = mapped_column(db.String(20), nullable=False)  # item, basket
+    entity_id: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    op: Mapped[str] = mapped_column(db.String(10), nullable=False)  # upsert, delete
+    created_at: Mapped[Optional[datetime]] = mapped_column(
+        db.DateTime, default=db.func.now()
+    )
+    __table_args__ = (
+        db.Index("ix_change_log_user_id_seq", "user_id", "seq"),
+        db.Index("ix_change_log_entity", "entity", "entity_id", "seq"),
+        # seq darf nach dem Löschen alter Einträge nicht wiederverwendet werden
+        {"sqlite_autoincrement": True},
+    )
 
-def send_email_smtp(recipient: str, subject: str, html_body: str) -> bool:
-    sender = app.config.get("MAIL_DEFAULT_SENDER")
-    smtp_server = app.config.get("MAIL_SERVER")
-    smtp_port = app.config.get("MAIL_PORT")
-    username = app.config.get("MAIL_USERNAME")
-    password = app.config.get("MAIL_PASSWORD")
 
-    msg = EmailMessage()
-    msg["From"] = sender
-    msg["To"] = recipient
-    msg["Subject"] = subject
-    msg.set_content(html_body, subtype="html")
+class ChangeLogCompaction(db.Model):
+    """Protokoll der Kompaktierungen; ``compacted_seq`` ist die höchste
+    entfernte seq, ältere Sync-Stände müssen neu geladen werden."""
 
-    context = ssl.create_default_context()
-    try:
-        with smtplib.SMTP_SSL(
-            str(smtp_server), smtp_port or 0, context=context
-        ) as server:
-            server.login(str(username), str(password))
-            server.sendmail(str(sender), recipient, msg.as_string())
-        print(f"E-Mail erfolgreich an {recipient} gesendet.")
-        return True
-    except Exception as e:
-        print("Fehler beim Versenden der E-Mail:", e)
-        return False
+    __tablename__ = "change_log_compaction"
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    compacted_seq: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    compacted_at: Mapped[Optional[datetime]] = mapped_column(
+        db.DateTime, default=db.func.now()
+    )
 
 
-def get_logo_base64() -> str:
-    """Liest das SVG-Logo aus dem templates-Verzeichnis und kodiert es als Base64-String."""
-    logo_path = os.path.join(app.root_path, "templates", "prepper-app.svg")
-    with open(logo_path, "rb") as f:
-        encoded_logo = base64.b64encode(f.read()).decode("utf-8")
-    return encoded_logo
+class MediaBlob(db.Model):
+    """Bilddaten, adressiert über den SHA-256 ihres Inhalts.
 
+    Items, Gruppen und User speichern nur noch die Referenz ``/media/<hash>``,
+    identische Bilder (z.B. das Standard-Icon) liegen genau einmal vor.
+    """
 
-def send_activation_email(user: User):
-    token = generate_token(user.email, salt="activate-account")
-    activation_url = url_for("activate_account", token=token, _external=True)
-    html = render_template(
-        "activate_account_mail.html",
-        activation_url=activation_url,
-        username=user.username,
-        logo_base64=get_logo_base64(),
-        current_year=2025,  # oder dynamisch: datetime.datetime.now().year
+    __tablename__ = "media_blob"
+    hash: Mapped[str] = mapped_column(db.String(64), primary_key=True)
+    content_type: Mapped[str] = mapped_column(db.String(50), nullable=False)
+    size: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    data: Mapped[bytes] = mapped_column(db.LargeBinary, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(
+        db.DateTime, default=db.func.now()
     )
-    print(html)
-    try:
-        # Versuche, die E-Mail zu senden, und werfe g
-        send_email_smtp(user.email, "Aktivieren Sie Ihren Account", html)
-    except Exception:
-        print("Detaillierter Fehler:")
-        print(traceback.format_exc())
 
+    def __init__(self, hash: str, content_type: str, data: bytes):
+        self.hash = hash
+        self.content_type = content_type
+        self.data = data
+        self.size = len(data)
 
-def send_forgot_password_email(user: User):
-    token = generate_token(user.email, salt="reset-password")
-    reset_url = url_for("reset_password", token=token, _external=True)
-    html = render_template(
-        "forgot_password_mail.html",
-        reset_url=reset_url,
-        username=user.username,
-        logo_base64=get_logo_base64(),
-        current_year=2025,
+
+class MediaVariant(db.Model):
+    """Verkleinerte Fassung eines Bildes (Thumbnail) in fester Kantenlänge"""
+
+    __tablename__ = "media_variant"
+    source_hash: Mapped[str] = mapped_column(
+        db.String(64), db.ForeignKey("media_blob.hash"), primary_key=True
+    )
+    size: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    variant_hash: Mapped[str] = mapped_column(
+        db.String(64), db.ForeignKey("media_blob.hash"), nullable=False
     )
-    print(html)
-    try:
-        send_email_smtp(user.email, "Passwort zurücksetzen", html)
-    except Exception:
-        print("Detaillierter Fehler:")
-        print(traceback.format_exc())
 
 
-def send_group_invitation_email_modern(invitation: GroupInvitation):
-    """Sendet eine E-Mail-Einladung für eine Gruppe mit neuem Token-System"""
-    group = invitation.group
-    inviter = invitation.inviter
+class SchemaMigration(db.Model):
+    """Bereits ausgeführte einmalige Datenmigrationen (siehe ensure_schema)"""
 
-    # Verwende die vom Frontend bereitgestellte URL oder erstelle eine neue
-    if invitation.invite_url:
-        join_url = invitation.invite_url
-    else:
-        # Fallback: Erstelle URL mit neuem Format
-        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-        join_url = f"{frontend_url}/invite/{invitation.invite_token}"
-    print(f"Join URL: {join_url}")
-    html = render_template(
-        "group_invitation_mail_modern.html",  # Neues Template
-        inviter_name=inviter.username,
-        group_name=group.name,
-        group_description=group.description,
-        join_url=join_url,  # Neue URL mit /invite/:token
-        invite_code=group.invite_code,  # Alter Code als Fallback
-        logo_base64=get_logo_base64(),
-        current_year=2025,
-    )
+    __tablename__ = "schema_migration"
+    name: Mapped[str] = mapped_column(db.String(100), primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(db.DateTime, nullable=False)
 
-    try:
-        send_email_smtp(
-            invitation.invited_email,
-            f"Einladung zur Gruppe '{group.name}' - Prepper App",
-            html,
-        )
-        print(
-            f"Moderne Gruppeneinladung erfolgreich an {invitation.invited_email} gesendet."
-        )
-    except Exception:
-        print("Detaillierter Fehler beim Senden der modernen Gruppeneinladung:")
-        print(traceback.format_exc())
 
+class IconLookup(db.Model):
+    """Zwischengespeichertes Ergebnis der Icon-Suche für einen Item-Namen.
 
-def send_group_invitation_email(invitation: GroupInvitation):
-    """Sendet eine E-Mail-Einladung für eine Gruppe"""
-    group = invitation.group
-    inviter = invitation.inviter
+    ``icon`` ist None, wenn die Suche nichts gefunden hat oder fehlgeschlagen
+    ist (Negativ-Cache).
+    """
 
-    # Join-URL erstellen
-    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-    join_url = f"{frontend_url}/groups/join/{invitation.invite_token}"
+    __tablename__ = "icon_lookup"
+    name_key: Mapped[str] = mapped_column(db.String(255), primary_key=True)
+    icon: Mapped[Optional[str]] = mapped_column(db.Text, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(db.DateTime, nullable=False)
 
-    html = render_template(
-        "group_invitation_mail.html",
-        inviter_name=inviter.username,
-        group_name=group.name,
-        group_description=group.description,
-        join_url=join_url,
-        invite_code=group.invite_code,
-        logo_base64=get_logo_base64(),
-        current_year=2025,
+
+class EmailOutbox(db.Model):
+    """Ausgehende E-Mail, die vom Mail-Worker zugestellt wird.
+
+    Wird in derselben Transaktion wie der auslösende Datensatz (User,
+    Einladung) geschrieben, damit keine E-Mail verloren geht oder ohne
+    Datensatz verschickt wird.
+    """
+
+    __tablename__ = "email_outbox"
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True, autoincrement=True)
+    recipient: Mapped[str] = mapped_column(db.String(120), nullable=False)
+    subject: Mapped[str] = mapped_column(db.String(255), nullable=False)
+    html_body: Mapped[str] = mapped_column(db.Text, nullable=False)
+    status: Mapped[str] = mapped_column(db.String(10), default="pending")
+    attempts: Mapped[int] = mapped_column(db.Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(db.DateTime, default=datetime.now)
+    last_error: Mapped[Optional[str]] = mapped_column(db.Text, nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(
+        db.DateTime, default=db.func.now()
     )
+    sent_at: Mapped[Optional[datetime]] = mapped_column(db.DateTime, nullable=True)
 
-    try:
-        send_email_smtp(
-            invitation.invited_email,
-            f"Einladung zur Gruppe '{group.name}' - Prepper App",
-            html,
-        )
-        print(f"Gruppeneinladung erfolgreich an {invitation.invited_email} gesendet.")
-    except Exception:
-        print("Detaillierter Fehler beim Senden der Gruppeneinladung:")
-        print(traceback.format_exc())
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
 
 
-### ROUTENDEFINITIONEN ###
-## AUTHENTICATION ##
-@app.route("/register", methods=["POST"])
-def register():
-    data = request.get_json()
-    if (
-        not data
-        or "username" not in data
-        or "password" not in data
-        or "email" not in data
-    ):
-        return jsonify({"error": "Invalid input"}), 400
+def get_user_group_ids(user_id):
+    """Hilfsfunktion: Gibt alle Gruppen-IDs zurück, in denen der User Mitglied ist"""
+    user_groups = UserGroup.query.filter_by(user_id=user_id).all()
+    return [ug.group_id for ug in user_groups]
 
-    # Sicherstellen, dass E-Mail noch nicht vergeben ist
-    if User.query.filter_by(email=data["email"].lower()).first():
-        return (
-            jsonify(
-                {"error": "Die E-Mail ist bereits mit einem anderen Account verknüpft."}
-            ),
-            409,
-        )
 
-    # Sicherstellen, dass Benutzername noch nicht vergeben ist
-    if User.query.filter_by(username=data["username"]).first():
-        return jsonify({"error": "Der Benutzername existiert bereits"}), 409
+def get_group_member_ids(user_id):
+    """Hilfsfunktion: Gibt alle User-IDs zurück, die in den gleichen Gruppen sind wie der aktuelle User"""
+    # Innerhalb von /batch wird die Mitgliedschaft nur einmal aufgelöst
+    batch_cache = g.get("batch_member_ids") if has_request_context() else None
+    if batch_cache is not None and user_id in batch_cache:
+        return batch_cache[user_id]
 
-    user = User(username=data["username"])
-    user.set_email(data["email"])
-    user.set_password(data["password"])
-    user.image = data.get("image") or None
-    user.persons = data.get("persons") or 1
-    user.activated = False  # Account zunächst inaktiv
-    user.groups = []  # Keine Gruppen zu Beginn
+    group_ids = get_user_group_ids(user_id)
+    if not group_ids:
+        member_ids = [user_id]  # Nur der User selbst
+    else:
+        # Alle User in den gleichen Gruppen finden
+        group_members = UserGroup.query.filter(UserGroup.group_id.in_(group_ids)).all()
+        member_ids = list(
+            set([gm.user_id for gm in group_members])
+        )  # Duplikate entfernen
+
+        # Den aktuellen User immer hinzufügen
+        if user_id not in member_ids:
+            member_ids.append(user_id)
+
+    if batch_cache is not None:
+        batch_cache[user_id] = member_ids
+    return member_ids
 
-    # Sende Aktivierungs-E-Mail
-    try:
-        send_activation_email(user)
-    except Exception as e:
-        print(e)
-        return jsonify({"error": "E-Mail konnte nicht gesendet werden."}), 500
 
-    db.session.add(user)
-    db.session.commit()
-    return (
-        user.__to_dict__(),
-        201,
-    )
+### INVENTORY QUERY LAYER ###
+# Spalten von StorageItem, die 1:1 als Feld ausgegeben werden
+ITEM_COLUMN_FIELDS = (
+    "name",
+    "amount",
+    "lowestAmount",
+    "midAmount",
+    "unit",
+    "packageQuantity",
+    "packageUnit",
+    "storageLocation",
+    "icon",
+)
+ITEM_FIELDS = ("id", "categories", "owner", "isOwner", "nutrients") + ITEM_COLUMN_FIELDS
+BASKET_FIELDS = ("id", "name", "amount", "categories", "icon")
+GROUP_FIELDS = (
+    "id",
+    "name",
+    "description",
+    "image",
+    "role",
+    "memberCount",
+    "inviteCode",
+    "isCreator",
+    "createdAt",
+)
 
 
-@app.route("/activate-account/<token>", methods=["GET"])
-def activate_account(token):
-    print("Aktivierungslink empfangen:", token)
-    try:
-        email = confirm_token(token, salt="activate-account")
-    except (SignatureExpired, BadSignature):
-        return jsonify({"error": "Aktivierungslink ungültig oder abgelaufen."}), 400
+def parse_fields(allowed) -> Optional[set]:
+    """Liest die Projektion aus ``?fields=a,b`` und ``?exclude=c``.
 
-    user = User.query.filter_by(email=email).first_or_404()
-    if not user.activated:
-        user.activated = True
-        db.session.commit()
+    Gibt None zurück, wenn keine Projektion angefragt wurde (alle Felder).
+    Wirft ValueError bei unbekannten Feldnamen.
+    """
+    fields_arg = request.args.get("fields")
+    exclude_arg = request.args.get("exclude")
+    if not fields_arg and not exclude_arg:
+        return None
 
-    access_token = create_access_token(identity=str(user.id))
-    refresh_token = create_refresh_token(identity=str(user.id))
+    fields = set(allowed)
+    if fields_arg:
+        fields = {f.strip() for f in fields_arg.split(",") if f.strip()}
+    excluded = {f.strip() for f in (exclude_arg or "").split(",") if f.strip()}
 
-    response = make_response(
-        redirect(os.getenv("FRONTEND_URL", "http://192.168.178.79:3000"))
+    unknown = (fields | excluded) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    return fields - excluded
+
+
+def inventory_load_options(fields: Optional[set] = None):
+    """Ladestrategien für StorageItem inkl. Besitzer und Nährstoffbaum.
+
+    Der Besitzer (many-to-one) wird per JOIN mitgeladen, der Nährstoffbaum
+    per selectinload je Ebene. Damit kostet eine Liste beliebiger Länge eine
+    feste Anzahl an Statements statt einer Abfrage pro Item und Ebene.
+    Mit ``fields`` werden nur die benötigten Spalten gelesen und nicht
+    angefragte Beziehungen gar nicht erst geladen.
+    """
+    owner = joinedload(StorageItem.user).load_only(User.id, User.username)
+    categories = selectinload(StorageItem.linked_categories).load_only(Category.name)
+    nutrients = (
+        selectinload(StorageItem.nutrient)
+        .selectinload(Nutrient.values)
+        .selectinload(NutrientValue.values)
     )
-    response.set_cookie("access_token", access_token, httponly=True, secure=True)
-    response.set_cookie("refresh_token", refresh_token, httponly=True, secure=True)
-    return response
+    if fields is None:
+        return (owner, categories, nutrients)
+
+    columns = [
+        getattr(StorageItem, field) for field in ITEM_COLUMN_FIELDS if field in fields
+    ]
+    options = [load_only(StorageItem.user_id, *columns)]
+    options.append(
+        categories if "categories" in fields else noload(StorageItem.linked_categories)
+    )
+    options.append(owner if "owner" in fields else noload(StorageItem.user))
+    options.append(nutrients if "nutrients" in fields else noload(StorageItem.nutrient))
+    return tuple(options)
 
 
-@app.route("/forgot-password", methods=["POST"])
-def forgot_password():
-    data = request.get_json()
-    if not data or "email" not in data:
-        return jsonify({"error": "Invalid input"}), 400
+def inventory_query(accessible_user_ids, fields: Optional[set] = None):
+    """Query über alle für den User sichtbaren StorageItems mit Eager Loading"""
+    return StorageItem.query.options(*inventory_load_options(fields)).filter(
+        StorageItem.user_id.in_(accessible_user_ids)
+    )
 
-    user = User.query.filter_by(email=data["email"].lower()).first()
-    if not user:
-        return jsonify({"error": "Kein Benutzer mit dieser E-Mail gefunden."}), 404
 
-    send_forgot_password_email(user)
+def get_inventory_item(item_id, fields: Optional[set] = None) -> Optional[StorageItem]:
+    """Lädt ein einzelnes StorageItem inkl. Besitzer und Nährstoffbaum"""
     return (
-        jsonify(
-            {"message": "Eine E-Mail zum Zurücksetzen des Passworts wurde gesendet."}
-        ),
-        200,
+        StorageItem.query.options(*inventory_load_options(fields))
+        .filter(StorageItem.id == item_id)
+        .populate_existing()
+        .first()
     )
 
 
-@app.route("/reset-password/<token>", methods=["GET"])
-def reset_password_form(token):
-    try:
-        email = confirm_token(token, salt="reset-password")
-    except (SignatureExpired, BadSignature):
-        return jsonify({"error": "Link ungültig oder abgelaufen."}), 400
+def serialize_nutrient(nutrient: Optional[Nutrient]):
+    if nutrient is None:
+        return None
+    return {
+        "id": nutrient.id,
+        "description": nutrient.description,
+        "unit": nutrient.unit,
+        "amount": nutrient.amount,
+        "values": [
+            {
+                "id": v.id,
+                "name": v.name,
+                "color": v.color,
+                "values": [{"typ": t.typ, "value": t.value} for t in v.values],
+            }
+            for v in nutrient.values
+        ],
+    }
 
-    # Hier renderst du ein HTML-Formular, das das neue Passwort abfragt.
-    # Du kannst dafür ein Template (z. B. reset_password.html) nutzen.
-    return render_template("reset_password.html", token=token, email=email)
 
+def serialize_storage_item(
+    item: StorageItem, user_id: Optional[int] = None, fields: Optional[set] = None
+):
+    """Wandelt ein StorageItem in das API-Format um.
+
+    Wird ``user_id`` übergeben, werden zusätzlich Besitzer-Informationen
+    (``owner``, ``isOwner``) ausgegeben, wie sie die Listenansicht benötigt.
+    Mit ``fields`` werden nur die angefragten Felder ausgegeben.
+    """
+    data = {}
+    if fields is None or "id" in fields:
+        data["id"] = item.id
+    for field in ITEM_COLUMN_FIELDS:
+        if fields is None or field in fields:
+            data[field] = getattr(item, field)
+    if "icon" in data:
+        data["icon"] = media_url(item.icon)
+    if fields is None or "categories" in fields:
+        data["categories"] = [category.name for category in item.linked_categories]
+    if user_id is not None:
+        if fields is None or "owner" in fields:
+            data["owner"] = item.user.username  # Zeige den Besitzer des Items
+        if fields is None or "isOwner" in fields:
+            # Zeige ob der aktuelle User der Besitzer ist
+            data["isOwner"] = item.user_id == user_id
+    if fields is None or "nutrients" in fields:
+        data["nutrients"] = serialize_nutrient(item.nutrient)
+    return data
+
+
+def serialize_basket_item(item: BasketItem, fields: Optional[set] = None):
+    # Nicht angefragte Felder nicht anfassen, sonst lädt das ORM sie einzeln nach
+    data = {}
+    if fields is None or "id" in fields:
+        data["id"] = item.id
+    if fields is None or "name" in fields:
+        data["name"] = item.name
+    if fields is None or "amount" in fields:
+        data["amount"] = item.amount
+    if fields is None or "categories" in fields:
+        data["categories"] = [category.name for category in item.linked_categories]
+    if fields is None or "icon" in fields:
+        data["icon"] = media_url(item.icon)
+    return data
+
+
+### CATEGORIES ###
+def resolve_category_ids(names, user_id) -> dict:
+    """Liefert die IDs zu Kategorienamen und legt fehlende Kategorien an.
+
+    Kategorienamen sind eindeutig, jeder Name hat genau eine Zeile. Neue
+    Kategorien gehören dem schreibenden User; gleichzeitiges Anlegen
+    desselben Namens fängt insert_or_ignore() ab.
+    """
+    names = {name.strip() for name in names if name and name.strip()}
+    if not names:
+        return {}
+    ids = dict(
+        db.session.query(Category.name, Category.id)
+        .filter(Category.name.in_(names))
+        .all()
+    )
+    missing = names - set(ids)
+    if missing:
+        for name in sorted(missing):
+            insert_or_ignore(
+                Category,
+                {"name": name, "user_id": int(user_id)},
+                index_elements=[Category.__table__.c.name],
+            )
+        ids.update(
+            db.session.query(Category.name, Category.id)
+            .filter(Category.name.in_(missing))
+            .all()
+        )
+    return ids
 
-@app.route("/reset-password/<token>", methods=["POST"])
-def reset_password(token):
-    # Verwende request.form.to_dict() als Fallback, wenn JSON-Daten nicht vorliegen.
-    data = request.form.to_dict() if request.form else (request.get_json() or {})
-    if not data or "password" not in data:
-        return jsonify({"error": "Invalid input"}), 400
 
-    try:
-        email = confirm_token(token, salt="reset-password")
-    except (SignatureExpired, BadSignature):
-        return jsonify({"error": "Link ungültig oder abgelaufen."}), 400
+def link_categories(item_column, categories_by_item: dict, user_id):
+    """Ersetzt die Kategorie-Zuordnungen mehrerer Items mit je einem Statement.
 
-    user = User.query.filter_by(email=email).first_or_404()
-    user.set_password(data["password"])
-    db.session.commit()
+    ``item_column`` ist die Item-Spalte der Zuordnungstabelle (z.B.
+    ``storage_item_category.c.storage_item_id``), ``categories_by_item``
+    bildet Item-IDs auf Listen von Kategorienamen ab. Fehlende Kategorien
+    werden angelegt, siehe resolve_category_ids().
+    """
+    if not categories_by_item:
+        return
+    table = item_column.table
+    db.session.execute(table.delete().where(item_column.in_(list(categories_by_item))))
 
-    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-    success_url = f"{frontend_url}/resetSuccess?resetSuccess=true&message=Passwort%20erfolgreich%20zurückgesetzt."
+    ids = resolve_category_ids(
+        [name for names in categories_by_item.values() for name in names or []],
+        user_id,
+    )
+    rows = []
+    for item_id, names in categories_by_item.items():
+        seen = set()
+        for name in names or []:
+            name = name.strip() if name else name
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            rows.append(
+                {
+                    item_column.key: item_id,
+                    "category_id": ids[name],
+                    "position": len(seen) - 1,
+                }
+            )
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+def filter_by_category(query, model, item_column):
+    """Filtert über ``?category=a,b`` (beliebige der Kategorien) per Index-Join"""
+    names = [
+        name.strip()
+        for name in request.args.get("category", "").split(",")
+        if name.strip()
+    ]
+    if not names:
+        return query
+    table = item_column.table
+    matching = (
+        db.select(item_column)
+        .join(Category, Category.id == table.c.category_id)
+        .where(Category.name.in_(names))
+    )
+    return query.filter(model.id.in_(matching))
+
+
+@event.listens_for(StorageItem, "after_delete")
+def _unlink_storage_item_categories(mapper, connection, target):
+    connection.execute(
+        storage_item_category.delete().where(
+            storage_item_category.c.storage_item_id == target.id
+        )
+    )
+
+
+@event.listens_for(BasketItem, "after_delete")
+def _unlink_basket_item_categories(mapper, connection, target):
+    connection.execute(
+        basket_item_category.delete().where(
+            basket_item_category.c.basket_item_id == target.id
+        )
+    )
+
+
+def migrate_item_categories():
+    """Überführt die kommagetrennten Kategorien bestehender Items einmalig in
+    die Zuordnungstabellen, erledigt wird über schema_migration vermerkt."""
+    if db.session.get(SchemaMigration, "item_categories") is not None:
+        return
+    for model, item_column in (
+        (StorageItem, storage_item_category.c.storage_item_id),
+        (BasketItem, basket_item_category.c.basket_item_id),
+    ):
+        rows = db.session.execute(
+            db.select(model.id, model.user_id, model.categories).where(
+                model.categories.isnot(None), model.categories != ""
+            )
+        ).all()
+        for user_id in {row.user_id for row in rows}:
+            link_categories(
+                item_column,
+                {
+                    row.id: row.categories.split(",")
+                    for row in rows
+                    if row.user_id == user_id
+                },
+                user_id,
+            )
+    insert_or_ignore(
+        SchemaMigration, {"name": "item_categories", "applied_at": datetime.now()}
+    )
+    db.session.commit()
+
+
+### STOCK STATUS ###
+STOCK_STATUSES = ("low", "mid", "ok")
+LOW_STOCK_STATUSES = ("low", "mid")
+
+
+def stock_status_expression():
+    """Bestandsstatus als SQL-Ausdruck: low <= lowestAmount < mid <= midAmount < ok"""
+    return case(
+        (StorageItem.amount <= StorageItem.lowestAmount, "low"),
+        (StorageItem.amount <= StorageItem.midAmount, "mid"),
+        else_="ok",
+    )
+
+
+def filter_by_stock_status(query, status_arg: Optional[str], allowed=STOCK_STATUSES):
+    """Filtert über ``?status=low,mid``; wirft ValueError bei einem Status
+    außerhalb von ``allowed``"""
+    statuses = {s.strip() for s in (status_arg or "").split(",") if s.strip()}
+    if not statuses:
+        return query
+    unknown = statuses - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown status: {', '.join(sorted(unknown))}")
+    return query.filter(stock_status_expression().in_(statuses))
+
+
+### DELTA SYNC ###
+SYNC_PAGE_SIZE = 1000
+CHANGE_LOG_RETENTION_DAYS = 30
+
+
+def compact_change_log(retention_days: int = CHANGE_LOG_RETENTION_DAYS):
+    """Kompaktiert das Änderungsprotokoll.
+
+    Pro Item bleibt nur der jüngste Eintrag erhalten, was für Clients
+    verlustfrei ist. Einträge älter als ``retention_days`` werden ganz
+    entfernt; Clients mit älterem Stand erhalten danach 410 und laden neu.
+    """
+    latest = db.select(func.max(ChangeLog.seq)).group_by(
+        ChangeLog.entity, ChangeLog.entity_id
+    )
+    db.session.execute(db.delete(ChangeLog).where(ChangeLog.seq.not_in(latest)))
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    expired_seq = db.session.execute(
+        db.select(func.max(ChangeLog.seq)).where(ChangeLog.created_at < cutoff)
+    ).scalar()
+    if expired_seq is not None:
+        db.session.execute(db.delete(ChangeLog).where(ChangeLog.seq <= expired_seq))
+        db.session.add(ChangeLogCompaction(compacted_seq=expired_seq))
+    db.session.commit()
+
+
+@app.cli.command("compact-changelog")
+def compact_change_log_command():
+    """Kompaktiert das Änderungsprotokoll (z.B. täglich per Cron)"""
+    compact_change_log()
+    print("Änderungsprotokoll kompaktiert")
+
+
+### MEDIA STORE ###
+MEDIA_PREFIX = "/media/"
+MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+THUMBNAIL_SIZES = (64, 256)
+DEFAULT_THUMBNAIL_SIZE = 64
+THUMBNAIL_FORMAT = ("WEBP", "image/webp")
+
+
+def decode_data_url(value: str):
+    """Zerlegt eine ``data:image/...;base64,`` URL in Content-Type und Bytes"""
+    try:
+        header, encoded = value.split(",", 1)
+    except ValueError:
+        raise ValueError(
+            "Ungültige Bilddaten: Das Bildformat konnte nicht verarbeitet werden."
+        )
+    content_type = header.split(";")[0]
+    if content_type not in app.config["ALLOWED_CONTENT_TYPES"]:
+        raise ValueError(
+            "Ungültiges Bildformat: Es sind nur PNG-, JPG-, JPEG- oder GIF-Dateien erlaubt."
+        )
+    try:
+        data = base64.b64decode(encoded)
+    except Exception:
+        raise ValueError("Fehler beim Dekodieren der Bilddaten.")
+    if len(data) > MAX_IMAGE_SIZE:
+        raise ValueError("Die Bildgröße überschreitet das erlaubte Limit von 5 MB.")
+    return content_type[len("data:") :], data
+
+
+def insert_or_ignore(model, values: dict, index_elements=None) -> bool:
+    """Fügt eine Zeile ein, sofern ihr Primärschlüssel (bzw. die eindeutigen
+    Spalten ``index_elements``) noch frei ist.
+
+    INSERT ... ON CONFLICT DO NOTHING statt Prüfen-dann-Einfügen, damit
+    gleichzeitige identische Schreibzugriffe nicht mit IntegrityError
+    scheitern. Gibt zurück, ob die Zeile neu angelegt wurde.
+    """
+    table = model.__table__
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        dialect = postgresql if dialect_name == "postgresql" else sqlite
+        statement = dialect.insert(table).on_conflict_do_nothing(
+            index_elements=index_elements or list(table.primary_key.columns)
+        )
+        return db.session.execute(statement, values).rowcount > 0
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(table), values)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _add_media_blob(data: bytes, content_type: str):
+    """Fügt einen Blob hinzu, falls er noch nicht existiert; gibt (hash, neu) zurück"""
+    digest = hashlib.sha256(data).hexdigest()
+    if db.session.get(MediaBlob, digest) is not None:
+        return digest, False
+    created = insert_or_ignore(
+        MediaBlob,
+        {
+            "hash": digest,
+            "content_type": content_type,
+            "size": len(data),
+            "data": data,
+        },
+    )
+    return digest, created
+
+
+def render_thumbnail(data: bytes, size: int) -> Optional[bytes]:
+    """Skaliert ein Bild auf maximal ``size`` Pixel Kantenlänge herunter.
+
+    Gibt None zurück, wenn Pillow fehlt, das Bild nicht lesbar ist oder
+    bereits klein genug ist.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= size:
+                return None
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            output = io.BytesIO()
+            image.save(output, THUMBNAIL_FORMAT[0], quality=80)
+            return output.getvalue()
+    except Exception as e:
+        print(f"Thumbnail konnte nicht erzeugt werden: {e}")
+        return None
+
+
+def create_thumbnails(source_hash: str, data: bytes):
+    """Erzeugt alle Thumbnail-Varianten eines Bildes einmalig beim Speichern"""
+    variants = {}
+    for size in THUMBNAIL_SIZES:
+        thumbnail = render_thumbnail(data, size)
+        # Kleine Bilder werden unverändert als Variante verwendet
+        variants[size] = source_hash
+        if thumbnail is not None:
+            variants[size], _ = _add_media_blob(thumbnail, THUMBNAIL_FORMAT[1])
+    for size, variant_hash in variants.items():
+        insert_or_ignore(
+            MediaVariant,
+            {"source_hash": source_hash, "size": size, "variant_hash": variant_hash},
+        )
+
+
+def put_media_blob(data: bytes) -> str:
+    """Legt Bilddaten im Blob-Store ab (dedupliziert) und gibt die Referenz zurück.
+
+    Der Content-Type wird aus den Bytes ermittelt, nicht vom Client
+    übernommen; wirft ValueError bei ungültigen Bilddaten.
+    """
+    content_type = validate_image_data(data)
+    digest, created = _add_media_blob(data, content_type)
+    if created:
+        create_thumbnails(digest, data)
+    return f"{MEDIA_PREFIX}{digest}"
+
+
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+PIL_CONTENT_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif"}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MULTIPART_OVERHEAD = 64 * 1024
+IMAGE_UPLOAD_ENDPOINTS = {"upload_user_image", "upload_group_image", "upload_item_icon"}
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Ermittelt den Bildtyp anhand der Magic Bytes statt des Client-Headers"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+def validate_image_data(data: bytes) -> str:
+    """Prüft Bilddaten über Magic Bytes und (falls installiert) Pillow.
+
+    Gibt den tatsächlichen Content-Type zurück; wirft ValueError, wenn die
+    Bytes kein lesbares PNG, JPEG oder GIF sind.
+    """
+    content_type = sniff_image_type(data[:8])
+    if content_type is None:
+        raise ValueError(
+            "Ungültiges Bildformat: Es sind nur PNG-, JPG-, JPEG- oder GIF-Dateien erlaubt."
+        )
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+                image_format = image.format
+        except Exception:
+            raise ValueError(
+                "Ungültige Bilddaten: Das Bildformat konnte nicht verarbeitet werden."
+            )
+        if PIL_CONTENT_TYPES.get(image_format) != content_type:
+            raise ValueError(
+                "Ungültige Bilddaten: Das Bildformat konnte nicht verarbeitet werden."
+            )
+    return content_type
+
+
+def read_image_upload():
+    """Liest ein Bild aus multipart/form-data (Feld ``image``) oder einem rohen
+    ``image/*`` Body.
+
+    Der Body wird in Blöcken gelesen und abgebrochen, sobald das 5 MB Limit
+    überschritten ist; das Limit des Requests (LimitedRequest) greift schon
+    beim Parsen. Gibt ``(content_type, bytes)`` zurück.
+    """
+    try:
+        return _read_image_upload()
+    except RequestEntityTooLarge:
+        raise ImageTooLargeError(
+            "Die Bildgröße überschreitet das erlaubte Limit von 5 MB."
+        )
+
+
+def _read_image_upload():
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("image") or request.files.get("file")
+        if upload is None:
+            raise ValueError("Keine Bilddatei übergeben.")
+        stream = upload.stream
+    elif request.mimetype.startswith("image/"):
+        stream = request.stream
+    else:
+        raise ValueError(
+            "Bilder müssen als multipart/form-data oder image/* Body gesendet werden."
+        )
+
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > MAX_IMAGE_SIZE:
+            raise RequestEntityTooLarge()
+
+    content_type = sniff_image_type(bytes(buffer[:8]))
+    if content_type is None:
+        raise ValueError(
+            "Ungültiges Bildformat: Es sind nur PNG-, JPG-, JPEG- oder GIF-Dateien erlaubt."
+        )
+    return content_type, bytes(buffer)
+
+
+def store_image_upload():
+    """Speichert ein hochgeladenes Bild und gibt ``(referenz, fehler_response)`` zurück"""
+    try:
+        _, data = read_image_upload()
+        return put_media_blob(data), None
+    except ImageTooLargeError as e:
+        return None, (jsonify({"error": str(e)}), 413)
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+
+
+def is_media_url(value: Optional[str]) -> bool:
+    return bool(value) and (
+        value.startswith(MEDIA_PREFIX) or value.startswith(f"{app_url}{MEDIA_PREFIX}")
+    )
+
+
+def store_media(value: Optional[str]) -> Optional[str]:
+    """Wandelt ein übergebenes Bild in eine Blob-Referenz um.
+
+    Data-URLs werden validiert und im Blob-Store abgelegt, bereits
+    ausgelieferte Media-URLs auf ihre Referenz gekürzt. Andere Werte (z.B.
+    externe Thumbnail-URLs) bleiben unverändert. Wirft ValueError bei
+    ungültigen Bilddaten.
+    """
+    if not value or not isinstance(value, str):
+        return value
+    if value.startswith("data:"):
+        _, data = decode_data_url(value)
+        return put_media_blob(data)
+    if value.startswith(f"{app_url}{MEDIA_PREFIX}"):
+        # Thumbnail-Suffix entfernen, gespeichert wird immer das Original
+        blob_hash = value[len(f"{app_url}{MEDIA_PREFIX}") :].split("/", 1)[0]
+        return f"{MEDIA_PREFIX}{blob_hash}"
+    return value
+
+
+def requested_image_size() -> Optional[int]:
+    """Thumbnail-Größe für Bild-URLs aus ``?imageSize=64|256|original``"""
+    if not has_request_context():
+        return DEFAULT_THUMBNAIL_SIZE
+    size = request.args.get("imageSize")
+    if size == "original":
+        return None
+    if size and size.isdigit() and int(size) in THUMBNAIL_SIZES:
+        return int(size)
+    return DEFAULT_THUMBNAIL_SIZE
+
+
+def media_url(value: Optional[str]) -> Optional[str]:
+    """Macht aus einer Blob-Referenz eine vom Browser cachebare URL.
+
+    Standardmäßig wird auf das kleine Thumbnail verwiesen, siehe
+    requested_image_size().
+    """
+    if value and value.startswith(MEDIA_PREFIX):
+        size = requested_image_size()
+        if size:
+            return f"{app_url}{value}/{size}"
+        return f"{app_url}{value}"
+    return value
+
+
+@lru_cache(maxsize=1)
+def default_icon_blob() -> bytes:
+    _, data = decode_data_url(get_icon_as_base64("default_image.png"))
+    return data
+
+
+def default_icon_ref() -> str:
+    """Referenz auf das Standard-Icon, das nur einmal gespeichert wird"""
+    return put_media_blob(default_icon_blob())
+
+
+def migrate_inline_media(batch_size: int = 100):
+    """Verschiebt noch inline gespeicherte Data-URLs in den Blob-Store"""
+    for model, column in (
+        (StorageItem, StorageItem.icon),
+        (BasketItem, BasketItem.icon),
+        (Group, Group.image),
+        (User, User.image),
+    ):
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(model.id, column)
+                .where(column.like("data:%"), model.id > last_id)
+                .order_by(model.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row_id, value in rows:
+                try:
+                    ref = store_media(value)
+                except ValueError:
+                    continue
+                db.session.execute(
+                    db.update(model).where(model.id == row_id).values({column: ref})
+                )
+            last_id = rows[-1][0]
+            db.session.commit()
+
+
+### PAGINATION ###
+PAGE_SIZE_MAX = 500
+
+
+def encode_cursor(values) -> str:
+    """Kodiert die Sortierschlüssel des letzten Eintrags als opaken Cursor"""
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, keys) -> list:
+    """Dekodiert einen Cursor und prüft ihn gegen die Sortierspalten ``keys``
+    (Anzahl und Typ je Wert); wirft ValueError"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Invalid cursor")
+    for value, key in zip(values, keys):
+        if isinstance(value, bool) or not isinstance(value, key.type.python_type):
+            raise ValueError("Invalid cursor")
+    return values
+
+
+def paginate_keyset(query, model):
+    """Keyset-Pagination über ``?limit=&after=&order=id|name``.
+
+    Sortiert nach ``(id)`` bzw. ``(name, id)`` und setzt hinter dem Cursor
+    fort, statt mit OFFSET alle vorherigen Zeilen erneut zu lesen. Gibt die
+    Items der Seite und den Cursor der nächsten Seite (oder None) zurück.
+    Wirft ValueError bei ungültigen Parametern.
+    """
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE_MAX))
+    except ValueError:
+        raise ValueError("Invalid limit")
+    if limit < 1:
+        raise ValueError("Invalid limit")
+    limit = min(limit, PAGE_SIZE_MAX)
+
+    order = request.args.get("order", "id")
+    if order == "name":
+        keys = (model.name, model.id)
+    elif order == "id":
+        keys = (model.id,)
+    else:
+        raise ValueError("Invalid order")
+
+    after = request.args.get("after")
+    if after:
+        values = decode_cursor(after, keys)
+        query = query.filter(tuple_(*keys) > tuple_(*values))
+
+    rows = query.order_by(*keys).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, key.key) for key in keys])
+    return rows, next_cursor
+
+
+def wants_pagination() -> bool:
+    """Pagination ist optional, damit bestehende Clients weiter Arrays erhalten"""
+    return "limit" in request.args or "after" in request.args
+
+
+### STREAMING ###
+STREAM_BATCH_SIZE = 200
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson_stream() -> bool:
+    """Streaming über ``Accept: application/x-ndjson`` oder ``?stream=1``"""
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(query, serialize):
+    """Streamt eine Query zeilenweise als NDJSON.
+
+    Die Zeilen werden mit yield_per in Batches geladen und direkt in die
+    Response geschrieben, so bleibt der Speicherbedarf unabhängig von der
+    Größe des Inventars und das erste Byte geht sofort raus.
+    """
+
+    def generate():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield app.json.dumps(serialize(row)) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def wants_gzip() -> bool:
+    return "gzip" in request.accept_encodings
+
+
+def gzip_chunks(chunks):
+    """Komprimiert einen Strom von Text-Chunks on the fly mit gzip"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+### CONDITIONAL GET ###
+def bump_data_version(*user_ids):
+    """Erhöht die Versionszähler der übergebenen User (vor dem Commit aufrufen).
+
+    Ein INSERT ... ON CONFLICT DO UPDATE, damit zwei gleichzeitige erste
+    Schreibzugriffe eines Users nicht am Primärschlüssel scheitern.
+    """
+    uids = sorted(set(int(uid) for uid in user_ids))
+    if not uids:
+        return
+    table = DataVersion.__table__
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        dialect = postgresql if dialect_name == "postgresql" else sqlite
+        statement = dialect.insert(table).on_conflict_do_update(
+            index_elements=[table.c.user_id], set_={"version": table.c.version + 1}
+        )
+        db.session.execute(statement, [{"user_id": uid, "version": 1} for uid in uids])
+        return
+    for uid in uids:
+        updated = (
+            db.session.query(DataVersion)
+            .filter(DataVersion.user_id == uid)
+            .update(
+                {DataVersion.version: DataVersion.version + 1},
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            db.session.add(DataVersion(user_id=uid, version=1))
+
+
+def log_change(entity: str, entity_ids, user_id, op: str = "upsert"):
+    """Schreibt Einträge ins Änderungsprotokoll (vor dem Commit aufrufen)"""
+    rows = [
+        {"user_id": int(user_id), "entity": entity, "entity_id": entity_id, "op": op}
+        for entity_id in entity_ids
+    ]
+    if rows:
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+
+
+def log_membership_change(*user_ids):
+    """Protokolliert geänderte Gruppenmitgliedschaften (vor dem Commit aufrufen).
+
+    Damit ändert sich für diese User die Menge der sichtbaren Besitzer; ihr
+    Delta-Sync ist ab hier unvollständig und wird per 410 zurückgesetzt, der
+    Mitglieder-Cache eines laufenden /batch wird verworfen.
+    """
+    rows = [
+        {"user_id": uid, "entity": "membership", "entity_id": uid, "op": "reset"}
+        for uid in set(int(uid) for uid in user_ids)
+    ]
+    if rows:
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+    # Die in /batch zwischengespeicherten Mitglieder sind ab hier veraltet
+    if has_request_context() and g.get("batch_member_ids"):
+        g.batch_member_ids.clear()
+
+
+def get_group_user_ids(group_id) -> List[int]:
+    """Hilfsfunktion: Gibt alle User-IDs einer Gruppe zurück"""
+    rows = db.session.query(UserGroup.user_id).filter_by(group_id=group_id).all()
+    return [row.user_id for row in rows]
+
+
+def collection_etag(scope: str, user_id, accessible_user_ids) -> str:
+    """ETag für eine Liste über die Versionen aller sichtbaren User.
+
+    Kostet einen indizierten Lookup in data_version statt Abfrage und
+    Serialisierung der eigentlichen Daten.
+    """
+    versions = dict(
+        db.session.query(DataVersion.user_id, DataVersion.version)
+        .filter(DataVersion.user_id.in_(accessible_user_ids))
+        .all()
+    )
+    raw = "|".join(
+        [
+            scope,
+            str(user_id),
+            request.query_string.decode("latin-1"),
+            str(request.accept_mimetypes),
+            ",".join(
+                f"{uid}:{versions.get(uid, 0)}" for uid in sorted(accessible_user_ids)
+            ),
+        ]
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def not_modified(etag: str):
+    """Gibt 304 zurück, falls der Client die aktuelle Version bereits hat.
+
+    Setzt außerdem den ETag auf die Response des aktuellen Requests.
+    """
+
+    @after_this_request
+    def set_etag(response):
+        if response.status_code in (200, 304):
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    if request.if_none_match.contains(etag):
+        return make_response("", 304)
+    return None
+
+
+def content_etag_response(payload):
+    """JSON-Response mit Inhalts-ETag für kleine Nachschlagelisten"""
+    response = jsonify(payload)
+    response.add_etag()
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
+### SEARCH ###
+# SQLite: FTS5-Index über Name, Kategorien und Lagerort, per Trigger synchron
+SQLITE_SEARCH_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS storage_item_fts USING fts5(
+        name, categories, "storageLocation",
+        content='storage_item', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS storage_item_fts_ai AFTER INSERT ON storage_item
+    BEGIN
+        INSERT INTO storage_item_fts(rowid, name, categories, "storageLocation")
+        VALUES (new.id, new.name, new.categories, new."storageLocation");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS storage_item_fts_ad AFTER DELETE ON storage_item
+    BEGIN
+        INSERT INTO storage_item_fts(
+            storage_item_fts, rowid, name, categories, "storageLocation"
+        )
+        VALUES ('delete', old.id, old.name, old.categories, old."storageLocation");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS storage_item_fts_au
+    AFTER UPDATE OF name, categories, "storageLocation" ON storage_item
+    BEGIN
+        INSERT INTO storage_item_fts(
+            storage_item_fts, rowid, name, categories, "storageLocation"
+        )
+        VALUES ('delete', old.id, old.name, old.categories, old."storageLocation");
+        INSERT INTO storage_item_fts(rowid, name, categories, "storageLocation")
+        VALUES (new.id, new.name, new.categories, new."storageLocation");
+    END""",
+)
+
+# PostgreSQL: GIN-Index über denselben tsvector-Ausdruck, den die Suche nutzt
+PG_SEARCH_VECTOR = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(categories, '')"
+    " || ' ' || coalesce(\"storageLocation\", ''))"
+)
+PG_SEARCH_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_storage_item_search "
+    f"ON storage_item USING GIN (({PG_SEARCH_VECTOR}))"
+)
+
+
+def create_search_index(connection):
+    """Legt den Volltextindex für StorageItem an, falls er noch fehlt"""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'storage_item_fts'"
+        ).first()
+        if exists:
+            return
+        for statement in SQLITE_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+        # Bestehende Items in den neuen Index übernehmen
+        connection.exec_driver_sql(
+            "INSERT INTO storage_item_fts(storage_item_fts) VALUES ('rebuild')"
+        )
+    elif dialect == "postgresql":
+        connection.exec_driver_sql(PG_SEARCH_DDL)
+
+
+@event.listens_for(StorageItem.__table__, "after_create")
+def _create_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+
+@event.listens_for(StorageItem, "before_update")
+def _update_name_key(mapper, connection, target):
+    if inspect(target).attrs.name.history.has_changes():
+        target.name_key = item_name_key(target.name)
+
+
+def migrate_storage_item_name_keys():
+    """Legt die Spalte name_key in bestehenden Datenbanken an und füllt sie
+    einmalig (casefold() gibt es nicht in SQL)."""
+    columns = {
+        column["name"] for column in inspect(db.engine).get_columns("storage_item")
+    }
+    if "name_key" not in columns:
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                "ALTER TABLE storage_item ADD COLUMN name_key VARCHAR(100)"
+            )
+    if db.session.get(SchemaMigration, "storage_item_name_key") is not None:
+        return
+    rows = db.session.execute(db.select(StorageItem.id, StorageItem.name)).all()
+    if rows:
+        table = StorageItem.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam("item_id"))
+            .values(name_key=bindparam("key")),
+            [{"item_id": row.id, "key": item_name_key(row.name)} for row in rows],
+        )
+    insert_or_ignore(
+        SchemaMigration,
+        {"name": "storage_item_name_key", "applied_at": datetime.now()},
+    )
+    db.session.commit()
+
+
+@event.listens_for(StorageItem.__table__, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS storage_item_fts")
+
+
+def search_terms(searchstring: str) -> List[str]:
+    """Zerlegt die Eingabe in Wörter; Operatoren der Suchsyntax fallen weg"""
+    return re.findall(r"\w+", searchstring.lower())
+
+
+def apply_item_search(query, searchstring: str, ranked: bool = True):
+    """Filtert eine StorageItem-Query über den Volltextindex.
+
+    Jedes Wort wird als Präfix gesucht (``nud`` findet ``Nudeln``), alle
+    Wörter müssen vorkommen. Mit ``ranked`` wird nach Relevanz sortiert.
+    Ohne Volltextindex (z.B. MySQL) wird auf LIKE zurückgefallen.
+    """
+    terms = search_terms(searchstring)
+    if not terms:
+        return query
+
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        fts = (
+            db.select(
+                literal_column("rowid").label("item_id"),
+                literal_column("bm25(storage_item_fts)").label("rank"),
+            )
+            .select_from(text("storage_item_fts"))
+            .where(text("storage_item_fts MATCH :match").bindparams(match=match))
+            .subquery()
+        )
+        query = query.join(fts, fts.c.item_id == StorageItem.id)
+        if ranked:
+            # bm25 liefert negative Werte, kleiner ist relevanter
+            query = query.order_by(fts.c.rank)
+        return query
+
+    if dialect == "postgresql":
+        tsquery = func.to_tsquery(
+            literal_column("'simple'"), " & ".join(f"{term}:*" for term in terms)
+        )
+        vector = literal_column(PG_SEARCH_VECTOR)
+        query = query.filter(vector.op("@@")(tsquery))
+        if ranked:
+            query = query.order_by(func.ts_rank(vector, tsquery).desc())
+        return query
+
+    return query.filter(func.lower(StorageItem.name).like(f"%{searchstring.lower()}%"))
+
+
+### FUZZY SEARCH ###
+FUZZY_THRESHOLD = 0.3
+TRIGRAM_MODELS = {"item": StorageItem, "basket": BasketItem}
+
+
+def name_trigrams(name: Optional[str]) -> set:
+    """Trigramme eines Namens wie bei pg_trgm (Wörter mit Leerzeichen gepolstert)"""
+    grams = set()
+    for word in re.findall(r"\w+", (name or "").lower()):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def index_name_trigrams(connection, kind: str, ref_id: int, name: Optional[str]):
+    """Ersetzt die Trigramme eines Namens im Index"""
+    table = NameTrigram.__table__
+    connection.execute(
+        table.delete().where(table.c.kind == kind, table.c.ref_id == ref_id)
+    )
+    grams = name_trigrams(name)
+    if grams:
+        connection.execute(
+            table.insert(),
+            [
+                {"kind": kind, "ref_id": ref_id, "trigram": gram, "total": len(grams)}
+                for gram in grams
+            ],
+        )
+
+
+def bulk_index_name_trigrams(connection, kind: str, names_by_id: dict):
+    """Wie index_name_trigrams(), aber für viele Einträge in zwei Statements"""
+    if not names_by_id:
+        return
+    table = NameTrigram.__table__
+    connection.execute(
+        table.delete().where(
+            table.c.kind == kind, table.c.ref_id.in_(list(names_by_id))
+        )
+    )
+    rows = []
+    for ref_id, name in names_by_id.items():
+        grams = name_trigrams(name)
+        rows.extend(
+            {"kind": kind, "ref_id": ref_id, "trigram": gram, "total": len(grams)}
+            for gram in grams
+        )
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def _register_trigram_events(kind, model):
+    @event.listens_for(model, "after_insert")
+    def after_insert(mapper, connection, target):
+        index_name_trigrams(connection, kind, target.id, target.name)
+
+    @event.listens_for(model, "after_update")
+    def after_update(mapper, connection, target):
+        if inspect(target).attrs.name.history.has_changes():
+            index_name_trigrams(connection, kind, target.id, target.name)
+
+    @event.listens_for(model, "after_delete")
+    def after_delete(mapper, connection, target):
+        index_name_trigrams(connection, kind, target.id, None)
+
+
+for _kind, _model in TRIGRAM_MODELS.items():
+    _register_trigram_events(_kind, _model)
+
+
+def rebuild_name_trigrams():
+    """Baut den Trigramm-Index für alle bestehenden Namen neu auf"""
+    with db.engine.begin() as connection:
+        connection.execute(NameTrigram.__table__.delete())
+        for kind, model in TRIGRAM_MODELS.items():
+            rows = connection.execute(db.select(model.id, model.name)).all()
+            for row in rows:
+                index_name_trigrams(connection, kind, row.id, row.name)
+
+
+def apply_fuzzy_search(query, model, searchstring: str, ranked: bool = True):
+    """Unscharfe Suche über die vorberechneten Trigramme.
+
+    Die Ähnlichkeit ist der Jaccard-Koeffizient der Trigramm-Mengen
+    (gemeinsame / alle), berechnet per GROUP BY über den Trigramm-Index.
+    Namen unterhalb von FUZZY_THRESHOLD werden verworfen.
+    """
+    grams = name_trigrams(searchstring)
+    if not grams:
+        return query
+
+    kind = next(k for k, m in TRIGRAM_MODELS.items() if m is model)
+    shared = func.count(NameTrigram.id)
+    similarity = (
+        shared * 1.0 / (func.max(NameTrigram.total) + len(grams) - shared)
+    ).label("similarity")
+    matches = (
+        db.select(NameTrigram.ref_id, similarity)
+        .where(NameTrigram.kind == kind, NameTrigram.trigram.in_(grams))
+        .group_by(NameTrigram.ref_id)
+        .subquery()
+    )
+    query = query.join(matches, matches.c.ref_id == model.id).filter(
+        matches.c.similarity >= FUZZY_THRESHOLD
+    )
+    if ranked:
+        query = query.order_by(matches.c.similarity.desc())
+    return query
+
+
+def wants_fuzzy_search() -> bool:
+    return request.args.get("fuzzy") in ("1", "true")
+
+
+def generate_token(email: str, salt: str) -> str:
+    ts = URLSafeTimedSerializer(app.config["SECRET_KEY"])
+    return ts.dumps(email, salt=salt)
+
+
+def confirm_token(token: str, salt: str, expiration=3600) -> str:
+    ts = URLSafeTimedSerializer(app.config["SECRET_KEY"])
+    return ts.loads(token, salt=salt, max_age=expiration)
+
+
+SMTP_IDLE_TIMEOUT = 60  # Sekunden bis eine ungenutzte Verbindung geschlossen wird
+SMTP_HEALTH_CHECK_AFTER = (
+    10  # Sekunden Leerlauf, ab denen vor dem Senden NOOP geprüft wird
+)
+SMTP_TIMEOUT = 30
+
+
+def build_email_message(recipient: str, subject: str, html_body: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = app.config.get("MAIL_DEFAULT_SENDER")
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    msg.set_content(html_body, subtype="html")
+    return msg
+
+
+class SMTPTransport:
+    """Hält eine authentifizierte SMTP_SSL-Verbindung pro Prozess offen.
+
+    Statt TLS-Handshake und Login pro E-Mail wird die Verbindung
+    wiederverwendet, nach längerem Leerlauf per NOOP geprüft, nach
+    SMTP_IDLE_TIMEOUT geschlossen und bei Abbruch einmal neu aufgebaut.
+    """
+
+    def __init__(self, idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.server: Optional[smtplib.SMTP_SSL] = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        context = ssl.create_default_context()
+        server = smtplib.SMTP_SSL(
+            str(app.config.get("MAIL_SERVER")),
+            app.config.get("MAIL_PORT") or 0,
+            context=context,
+            timeout=SMTP_TIMEOUT,
+        )
+        try:
+            server.login(
+                str(app.config.get("MAIL_USERNAME")),
+                str(app.config.get("MAIL_PASSWORD")),
+            )
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def close_if_idle(self):
+        with self.lock:
+            if (
+                self.server is not None
+                and time.monotonic() - self.last_used > self.idle_timeout
+            ):
+                self.close()
+
+    def _ensure_connection(self) -> smtplib.SMTP_SSL:
+        if self.server is not None:
+            idle = time.monotonic() - self.last_used
+            if idle > self.idle_timeout:
+                self.close()
+            elif idle > SMTP_HEALTH_CHECK_AFTER:
+                try:
+                    healthy = self.server.noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    healthy = False
+                if not healthy:
+                    self.close()
+        if self.server is None:
+            self._connect()
+        return cast(smtplib.SMTP_SSL, self.server)
+
+    def _send(self, msg: EmailMessage):
+        for attempt in range(2):
+            server = self._ensure_connection()
+            try:
+                server.send_message(msg)
+                self.last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # Verbindung vom Server geschlossen: einmal neu verbinden
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def send(self, recipient: str, subject: str, html_body: str):
+        """Versendet eine E-Mail; wirft bei Fehlern eine Exception"""
+        msg = build_email_message(recipient, subject, html_body)
+        with self.lock:
+            self._send(msg)
+
+    def send_batch(self, messages):
+        """Versendet mehrere ``(recipient, subject, html_body)`` über eine Sitzung.
+
+        Liefert pro E-Mail ``(nachricht, fehler_oder_None)``, sobald sie
+        verschickt wurde, so dass der Aufrufer den Status einzeln speichern kann.
+        """
+        for message in messages:
+            try:
+                self.send(*message)
+            except Exception as e:
+                yield message, e
+            else:
+                yield message, None
+
+
+mail_transport = SMTPTransport()
+
+
+def deliver_email(recipient: str, subject: str, html_body: str):
+    """Versendet eine E-Mail über die gemeinsame SMTP-Verbindung"""
+    mail_transport.send(recipient, subject, html_body)
+
+
+### BULK IMPORT ###
+def insert_returning_ids(
+    model, rows: List[dict], key: tuple, statement=None
+) -> List[int]:
+    """Fügt viele Zeilen ein und gibt ihre IDs in Eingabereihenfolge zurück.
+
+    Nutzt INSERT ... RETURNING als executemany (SQLite >= 3.35, PostgreSQL).
+    Die zurückgegebenen Zeilen werden über die Spalten ``key`` den
+    Eingabezeilen zugeordnet, bei gleichem Schlüssel in ID-Reihenfolge.
+    Datenbanken ohne RETURNING fügen zeilenweise ein.
+    """
+    if not rows:
+        return []
+    table = model.__table__
+    dialect = db.session.get_bind().dialect
+    if not dialect.insert_executemany_returning:
+        return [
+            db.session.execute(insert(table), row).inserted_primary_key[0]
+            for row in rows
+        ]
+    if statement is None:
+        statement = insert(table)
+    result = db.session.execute(
+        statement.returning(table.c.id, *(table.c[column] for column in key)),
+        rows,
+    )
+    ids_by_key: dict = {}
+    for row_id, *values in result:
+        ids_by_key.setdefault(tuple(values), []).append(row_id)
+    for ids in ids_by_key.values():
+        ids.sort(reverse=True)
+    return [ids_by_key[tuple(row[column] for column in key)].pop() for row in rows]
+
+
+def insert_storage_items(mappings: List[dict], user_id) -> List[int]:
+    """Fügt StorageItems ohne ORM-Objekte ein, IDs in Eingabereihenfolge"""
+    dialect = db.session.get_bind().dialect
+    if dialect.insert_executemany_returning:
+        return insert_returning_ids(StorageItem, mappings, ("name", "unit"))
+    # Ohne RETURNING: IDs über den Unique-Key (name, unit, user_id) nachladen
+    db.session.execute(insert(StorageItem.__table__), mappings)
+    keys = [(mapping["name"], mapping["unit"]) for mapping in mappings]
+    ids_by_key = {
+        (name, unit): item_id
+        for item_id, name, unit in db.session.execute(
+            db.select(StorageItem.id, StorageItem.name, StorageItem.unit).where(
+                StorageItem.user_id == user_id,
+                tuple_(StorageItem.name, StorageItem.unit).in_(keys),
+            )
+        )
+    }
+    return [ids_by_key[key] for key in keys]
+
+
+BULK_REQUIRED_KEYS = (
+    "name",
+    "amount",
+    "unit",
+    "storageLocation",
+    "lowestAmount",
+    "midAmount",
+)
+IMPORT_CHUNK_SIZE = 500
+IMPORT_MAX_LINE_LENGTH = 1024 * 1024
+IMPORT_MAX_ERRORS = 1000
+
+
+def is_integer(value) -> bool:
+    """JSON-Ganzzahl (bool zählt in Python als int, hier nicht)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value) -> bool:
+    """JSON-Zahl, ganzzahlig oder nicht"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_nutrients(nutrient_data):
+    """Prüft die Struktur der Nährwerte eines Items; wirft ValueError"""
+    if not isinstance(nutrient_data, dict):
+        raise ValueError("nutrients must be an object")
+    if not isinstance(nutrient_data.get("description"), str) or not isinstance(
+        nutrient_data.get("unit"), str
+    ):
+        raise ValueError("nutrients need a description and a unit")
+    if not is_number(nutrient_data.get("amount")):
+        raise ValueError("nutrients.amount must be a number")
+    values = nutrient_data.get("values", [])
+    if not isinstance(values, list):
+        raise ValueError("nutrients.values must be a list")
+    for value_data in values:
+        if not isinstance(value_data, dict) or not isinstance(
+            value_data.get("name"), str
+        ):
+            raise ValueError("every nutrient value needs a name")
+        if value_data.get("color") is not None and not isinstance(
+            value_data["color"], str
+        ):
+            raise ValueError("nutrient value color must be a string")
+        types = value_data.get("values", [])
+        if not isinstance(types, list) or not all(
+            isinstance(type_data, dict)
+            and isinstance(type_data.get("typ"), str)
+            and is_number(type_data.get("value"))
+            for type_data in types
+        ):
+            raise ValueError("every nutrient type needs a typ and a numeric value")
+
+
+def build_item_mapping(item_data, user_id, default_icon: bool = False) -> dict:
+    """Prüft einen Import-Datensatz und baut die Zeile für storage_item.
+
+    Ohne Icon bleibt ``icon`` leer (für die Icon-Suche) bzw. wird mit
+    ``default_icon`` auf das Standard-Icon gesetzt. Wirft ValueError.
+    """
+    if not isinstance(item_data, dict) or not all(
+        key in item_data and item_data[key] != "" for key in BULK_REQUIRED_KEYS
+    ):
+        raise ValueError("Invalid input data for one or more items")
+    for key in ("name", "unit", "storageLocation"):
+        if not isinstance(item_data[key], str):
+            raise ValueError(f"{key} must be a string")
+    for key in ("amount", "lowestAmount", "midAmount"):
+        if not is_integer(item_data[key]):
+            raise ValueError(f"{key} must be an integer")
+    if item_data.get("packageQuantity") is not None and not is_integer(
+        item_data["packageQuantity"]
+    ):
+        raise ValueError("packageQuantity must be an integer")
+    for key in ("packageUnit", "icon"):
+        if item_data.get(key) is not None and not isinstance(item_data[key], str):
+            raise ValueError(f"{key} must be a string")
+    categories = item_data.get("categories", [])
+    if not isinstance(categories, list) or not all(
+        isinstance(category, str) for category in categories
+    ):
+        raise ValueError("categories must be a list of strings")
+    if item_data.get("nutrients"):
+        validate_nutrients(item_data["nutrients"])
+    icon = store_media(item_data.get("icon")) or ""
+    if not icon and default_icon:
+        icon = default_icon_ref()
+    return {
+        "name": item_data["name"],
+        "amount": item_data["amount"],
+        "categories": (
+            ",".join(item_data["categories"]) if "categories" in item_data else None
+        ),
+        "lowestAmount": item_data["lowestAmount"],
+        "midAmount": item_data["midAmount"],
+        "unit": item_data["unit"],
+        "packageQuantity": item_data.get("packageQuantity"),
+        "packageUnit": item_data.get("packageUnit"),
+        "storageLocation": item_data["storageLocation"],
+        "icon": icon,
+        "user_id": user_id,
+    }
+
+
+def dedupe_item_batch(mappings: List[dict], payloads: list):
+    """Fasst doppelte Items (name, unit) zusammen, der letzte Eintrag gewinnt"""
+    unique = {}
+    for mapping, item_data in zip(mappings, payloads):
+        unique[(mapping["name"], mapping["unit"])] = (mapping, item_data)
+    return (
+        [mapping for mapping, _ in unique.values()],
+        [item_data for _, item_data in unique.values()],
+    )
+
+
+def existing_item_keys(keys, user_id) -> set:
+    """Bereits vorhandene (name, unit) eines Users, eine Abfrage"""
+    if not keys:
+        return set()
+    return set(
+        db.session.execute(
+            db.select(StorageItem.name, StorageItem.unit).where(
+                StorageItem.user_id == user_id,
+                tuple_(StorageItem.name, StorageItem.unit).in_(list(keys)),
+            )
+        ).all()
+    )
+
+
+def keep_existing_icons(mappings: List[dict], user_id):
+    """Upsert: bestehende Items ohne mitgeschicktes Icon behalten ihr Icon
+    und brauchen keine Icon-Suche"""
+    existing = existing_item_keys(
+        [(mapping["name"], mapping["unit"]) for mapping in mappings], user_id
+    )
+    for mapping in mappings:
+        if not mapping["icon"] and (mapping["name"], mapping["unit"]) in existing:
+            mapping["icon"] = None
+
+
+def write_item_batch(mappings: List[dict], payloads: list, user_id, mode: str):
+    """Schreibt einen Batch Items mit Trigrammen, Kategorien und Nährwerten.
+
+    Alles set-basiert: ein INSERT (bzw. Upsert) mit RETURNING für die Items,
+    danach ein Statement pro Tabelle. Committet nicht. Wirft IntegrityError
+    bei doppelten Items im Modus ``insert``.
+    """
+    if mode == "upsert":
+        item_ids = upsert_storage_items(mappings)
+    else:
+        item_ids = insert_storage_items(mappings, user_id)
+
+    # Der Core-Insert umgeht die ORM-Events des Trigramm-Index
+    bulk_index_name_trigrams(
+        db.session.connection(),
+        "item",
+        {item_id: mapping["name"] for item_id, mapping in zip(item_ids, mappings)},
+    )
+    # Nur mitgeschickte Kategorien ersetzen die bestehenden Zuordnungen
+    link_categories(
+        storage_item_category.c.storage_item_id,
+        {
+            item_id: item_data["categories"]
+            for item_id, item_data in zip(item_ids, payloads)
+            if "categories" in item_data
+        },
+        user_id,
+    )
+    nutrients_by_item = {
+        item_id: item_data["nutrients"]
+        for item_id, item_data in zip(item_ids, payloads)
+        if item_data.get("nutrients")
+    }
+    if mode == "upsert":
+        # Mitgeschickte Nährwerte ersetzen die bestehenden, sonst bleiben sie
+        delete_nutrients(list(nutrients_by_item))
+    insert_nutrients(nutrients_by_item, user_id)
+
+    log_change("item", item_ids, user_id)
+    bump_data_version(user_id)
+    return item_ids
+
+
+class ImportReport:
+    """Zählt importierte Zeilen und sammelt Fehler (begrenzt auf IMPORT_MAX_ERRORS)"""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line_number, message: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line_number, "error": message})
+
+    def to_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errorsTruncated": self.failed > len(self.errors),
+        }
+
+
+def read_ndjson_upload(report: ImportReport):
+    """Liest den Request-Body zeilenweise als NDJSON.
+
+    gzip wird über ``Content-Encoding: gzip`` oder den Content-Type
+    ``application/gzip`` erkannt und beim Lesen entpackt. Liefert
+    ``(zeilennummer, datensatz)``; kaputte Zeilen gehen in den Bericht.
+    """
+    stream = request.stream
+    if request.content_encoding == "gzip" or request.mimetype in (
+        "application/gzip",
+        "application/x-gzip",
+    ):
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    line_number = 0
+    try:
+        while True:
+            line = stream.readline(IMPORT_MAX_LINE_LENGTH + 1)
+            if not line:
+                break
+            line_number += 1
+            if len(line) > IMPORT_MAX_LINE_LENGTH and not line.endswith(b"\n"):
+                # Rest der überlangen Zeile verwerfen
+                while line and not line.endswith(b"\n"):
+                    line = stream.readline(IMPORT_MAX_LINE_LENGTH)
+                report.fail(line_number, "Zeile ist zu lang")
+                continue
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                report.fail(line_number, "Ungültiges JSON")
+    except (OSError, EOFError) as e:
+        raise ValueError(f"Upload konnte nicht gelesen werden: {e}")
+
+
+def import_item_chunk(chunk: list, user_id, mode: str, report: ImportReport):
+    """Schreibt und committet einen Chunk des NDJSON-Imports.
+
+    Im Modus ``insert`` werden bereits vorhandene oder im Chunk doppelte
+    Items vorab aussortiert und als Fehler der jeweiligen Zeile gemeldet.
+    """
+    if mode == "insert":
+        existing = existing_item_keys(
+            {(mapping["name"], mapping["unit"]) for _, mapping, _ in chunk}, user_id
+        )
+        accepted = []
+        for line_number, mapping, item_data in chunk:
+            key = (mapping["name"], mapping["unit"])
+            if key in existing:
+                report.fail(
+                    line_number,
+                    "Item with the same name, storageLocation, and unit already exists.",
+                )
+                continue
+            existing.add(key)
+            accepted.append((line_number, mapping, item_data))
+        chunk = accepted
+    if not chunk:
+        return
+    mappings = [mapping for _, mapping, _ in chunk]
+    payloads = [item_data for _, _, item_data in chunk]
+    if mode == "upsert":
+        mappings, payloads = dedupe_item_batch(mappings, payloads)
+        keep_existing_icons(mappings, user_id)
+    try:
+        write_item_batch(mappings, payloads, user_id, mode)
+        db.session.commit()
+    except (IntegrityError, KeyError, TypeError):
+        # Der Chunk wird verworfen und zeilenweise wiederholt, damit nur die
+        # fehlerhaften Zeilen gemeldet werden
+        db.session.rollback()
+        for line_number, mapping, item_data in chunk:
+            try:
+                write_item_batch([mapping], [item_data], user_id, mode)
+                db.session.commit()
+            except (IntegrityError, KeyError, TypeError) as e:
+                db.session.rollback()
+                report.fail(line_number, f"Zeile konnte nicht gespeichert werden: {e}")
+                continue
+            report.imported += 1
+        return
+    report.imported += len(chunk)
+
+
+UPSERT_ITEM_COLUMNS = ("amount", "lowestAmount", "midAmount", "storageLocation")
+# Optionale Felder: fehlen sie im Datensatz (None), bleibt der alte Wert
+UPSERT_OPTIONAL_ITEM_COLUMNS = ("categories", "packageQuantity", "packageUnit", "icon")
+
+
+def upsert_storage_items(mappings: List[dict]) -> List[int]:
+    """Fügt Items ein oder aktualisiert bestehende (name, unit, user_id).
+
+    Ein INSERT ... ON CONFLICT DO UPDATE pro Batch; optionale Felder, die
+    None sind (nicht mitgeschickt), behalten den bestehenden Wert. Wirft
+    ValueError, wenn die Datenbank kein ON CONFLICT kennt.
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(StorageItem.__table__)
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(StorageItem.__table__)
+    else:
+        raise ValueError(f"mode=upsert wird für {dialect_name} nicht unterstützt")
+    table = StorageItem.__table__
+    updates = {column: statement.excluded[column] for column in UPSERT_ITEM_COLUMNS}
+    for column in UPSERT_OPTIONAL_ITEM_COLUMNS:
+        updates[column] = func.coalesce(statement.excluded[column], table.c[column])
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.name, table.c.unit, table.c.user_id], set_=updates
+    )
+    return insert_returning_ids(StorageItem, mappings, ("name", "unit"), statement)
+
+
+def delete_nutrients(item_ids: List[int]):
+    """Löscht die Nährwerte mehrerer Items mit einem DELETE pro Tabelle"""
+    if not item_ids:
+        return
+    nutrient_ids = db.select(Nutrient.id).where(Nutrient.storage_item_id.in_(item_ids))
+    value_ids = db.select(NutrientValue.id).where(
+        NutrientValue.nutrient_id.in_(nutrient_ids)
+    )
+    db.session.execute(
+        db.delete(NutrientType).where(NutrientType.nutrient_value_id.in_(value_ids))
+    )
+    db.session.execute(
+        db.delete(NutrientValue).where(NutrientValue.nutrient_id.in_(nutrient_ids))
+    )
+    db.session.execute(
+        db.delete(Nutrient).where(Nutrient.storage_item_id.in_(item_ids))
+    )
+
+
+def insert_nutrients(nutrients_by_item: dict, user_id):
+    """Legt Nährwerte für viele Items mit einem executemany pro Tabelle an"""
+    if not nutrients_by_item:
+        return
+    item_ids = list(nutrients_by_item)
+    nutrient_ids = insert_returning_ids(
+        Nutrient,
+        [
+            {
+                "description": nutrients_by_item[item_id]["description"],
+                "unit": nutrients_by_item[item_id]["unit"],
+                "amount": nutrients_by_item[item_id]["amount"],
+                "storage_item_id": item_id,
+                "user_id": user_id,
+            }
+            for item_id in item_ids
+        ],
+        ("storage_item_id",),
+    )
+
+    value_rows = []
+    value_types = []
+    for item_id, nutrient_id in zip(item_ids, nutrient_ids):
+        for value_data in nutrients_by_item[item_id].get("values", []):
+            value_rows.append(
+                {
+                    "name": value_data["name"],
+                    "color": value_data.get("color"),
+                    "nutrient_id": nutrient_id,
+                    "user_id": user_id,
+                }
+            )
+            value_types.append(value_data.get("values", []))
+    value_ids = insert_returning_ids(NutrientValue, value_rows, ("nutrient_id", "name"))
+
+    type_rows = [
+        {
+            "typ": type_data["typ"],
+            "value": type_data["value"],
+            "nutrient_value_id": value_id,
+            "user_id": user_id,
+        }
+        for value_id, types in zip(value_ids, value_types)
+        for type_data in types
+    ]
+    if type_rows:
+        db.session.execute(insert(NutrientType.__table__), type_rows)
+
+
+### ATOMIC AMOUNTS ###
+def parse_amount_delta(data) -> int:
+    """Liest ``{"delta": n}`` aus dem Body; wirft ValueError"""
+    delta = data.get("delta") if isinstance(data, dict) else None
+    if isinstance(delta, bool) or not isinstance(delta, int):
+        raise ValueError("delta must be an integer")
+    return delta
+
+
+def apply_amount_delta(
+    model, item_id: int, delta: int, accessible_user_ids, minimum=None
+):
+    """Ändert ``amount`` in einem einzigen UPDATE ... RETURNING.
+
+    Kein Lesen-Ändern-Schreiben in Python, gleichzeitige Änderungen mehrerer
+    Gruppenmitglieder gehen daher nicht verloren. Die Berechtigung steckt im
+    WHERE. Gibt ``(amount, user_id)`` zurück oder None, wenn kein Item
+    gefunden oder erlaubt ist.
+    """
+    new_amount = model.amount + delta
+    if minimum is not None:
+        new_amount = case((new_amount < minimum, minimum), else_=new_amount)
+    statement = (
+        db.update(model)
+        .where(model.id == item_id, model.user_id.in_(accessible_user_ids))
+        .values(amount=new_amount)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(
+            statement.returning(model.amount, model.user_id)
+        ).first()
+    if db.session.execute(statement).rowcount == 0:
+        return None
+    return db.session.execute(
+        db.select(model.amount, model.user_id).where(model.id == item_id)
+    ).first()
+
+
+def increment_basket_item(name: str, user_id) -> Optional[int]:
+    """Erhöht ein vorhandenes BasketItem atomar um 1; gibt dessen ID oder None zurück"""
+    condition = (BasketItem.name == name, BasketItem.user_id == user_id)
+    statement = (
+        db.update(BasketItem)
+        .where(*condition)
+        .values(amount=BasketItem.amount + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(statement.returning(BasketItem.id)).scalar()
+    if db.session.execute(statement).rowcount == 0:
+        return None
+    return db.session.execute(db.select(BasketItem.id).where(*condition)).scalar()
+
+
+def insert_basket_item(values: dict) -> Optional[int]:
+    """Fügt ein BasketItem ein, sofern (name, user_id) noch frei ist.
+
+    Gibt die neue ID zurück oder None, wenn ein paralleler Request das Item
+    gerade angelegt hat (ON CONFLICT DO NOTHING).
+    """
+    table = BasketItem.__table__
+    dialect = db.session.get_bind().dialect
+    if dialect.name == "postgresql":
+        statement = postgresql.insert(table)
+    elif dialect.name == "sqlite":
+        statement = sqlite.insert(table)
+    else:
+        # Ohne ON CONFLICT schützt nur der Unique-Index (IntegrityError)
+        return db.session.execute(insert(table), values).inserted_primary_key[0]
+    statement = statement.on_conflict_do_nothing(
+        index_elements=[table.c.name, table.c.user_id]
+    )
+    if dialect.insert_returning:
+        return db.session.execute(statement.returning(table.c.id), values).scalar()
+    if db.session.execute(statement, values).rowcount == 0:
+        return None
+    return db.session.execute(
+        db.select(BasketItem.id).where(
+            BasketItem.name == values["name"], BasketItem.user_id == values["user_id"]
+        )
+    ).scalar()
+
+
+def merge_duplicate_basket_items():
+    """Fasst doppelte BasketItems (name, user_id) aus der Zeit vor dem
+    Unique-Index zusammen; das älteste bleibt mit der Summe der Mengen."""
+    duplicates = db.session.execute(
+        db.select(BasketItem.name, BasketItem.user_id)
+        .group_by(BasketItem.name, BasketItem.user_id)
+        .having(func.count() > 1)
+    ).all()
+    for name, user_id in duplicates:
+        rows = db.session.execute(
+            db.select(BasketItem.id, BasketItem.amount)
+            .where(BasketItem.name == name, BasketItem.user_id == user_id)
+            .order_by(BasketItem.id)
+        ).all()
+        keep_id = rows[0].id
+        removed_ids = [row.id for row in rows[1:]]
+        db.session.execute(
+            db.update(BasketItem)
+            .where(BasketItem.id == keep_id)
+            .values(amount=sum(row.amount or 0 for row in rows))
+            .execution_options(synchronize_session=False)
+        )
+        delete_basket_items(removed_ids)
+        log_change("basket", [keep_id], user_id)
+        log_change("basket", removed_ids, user_id, op="delete")
+        bump_data_version(user_id)
+    db.session.commit()
+
+
+### BASKET CHECKOUT ###
+CHECKOUT_DEFAULT_UNIT = "Stück"
+
+
+def match_storage_items(names, accessible_user_ids, user_id) -> dict:
+    """Ordnet Namen über item_name_key() StorageItems zu, eine Abfrage.
+
+    Verglichen wird die gespeicherte Spalte name_key über den Index
+    (user_id, name_key), da SQLite-lower() nur ASCII umwandelt. Gibt es
+    einen Namen mehrfach (andere Einheit, anderes Gruppenmitglied), gewinnt
+    das eigene Item, danach die kleinste ID.
+    """
+    keys = {item_name_key(name) for name in names}
+    if not keys:
+        return {}
+    rows = db.session.execute(
+        db.select(StorageItem.id, StorageItem.name_key, StorageItem.user_id)
+        .where(
+            StorageItem.user_id.in_(accessible_user_ids),
+            StorageItem.name_key.in_(keys),
+        )
+        .order_by((StorageItem.user_id != int(user_id)), StorageItem.id)
+    ).all()
+    matches = {}
+    for row in rows:
+        matches.setdefault(row.name_key, (row.id, row.user_id))
+    return matches
+
+
+def increment_storage_amounts(amounts_by_id: dict):
+    """Erhöht die Mengen mehrerer StorageItems mit einem executemany"""
+    if not amounts_by_id:
+        return
+    table = StorageItem.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == bindparam("item_id"))
+        .values(amount=table.c.amount + bindparam("delta")),
+        [
+            {"item_id": item_id, "delta": delta}
+            for item_id, delta in amounts_by_id.items()
+        ],
+    )
+
+
+def delete_basket_items(item_ids: List[int]):
+    """Löscht BasketItems samt Kategorien und Trigrammen ohne ORM-Objekte"""
+    if not item_ids:
+        return
+    db.session.execute(
+        basket_item_category.delete().where(
+            basket_item_category.c.basket_item_id.in_(item_ids)
+        )
+    )
+    # Der Core-Delete umgeht die ORM-Events des Trigramm-Index
+    bulk_index_name_trigrams(db.session.connection(), "basket", dict.fromkeys(item_ids))
+    db.session.execute(db.delete(BasketItem).where(BasketItem.id.in_(item_ids)))
+
+
+### BATCH ###
+BATCH_MAX_OPERATIONS = 100
+# Routen, die als Teiloperation von /batch erlaubt sind
+BATCH_ENDPOINTS = {
+    "get_items",
+    "get_item",
+    "add_item",
+    "update_item",
+    "delete_item",
+    "patch_item_amount",
+    "update_nutrients",
+    "get_basket",
+    "add_basket_item",
+    "update_basket_item",
+    "delete_basket_item",
+    "patch_basket_item",
+    "checkout_basket",
+}
+
+
+def commit_changes():
+    """Committet die Session; innerhalb von /batch wird nur geflusht und
+    erst am Ende des Batches gemeinsam committet."""
+    if g.get("in_batch"):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+### MAIL RENDERING ###
+MAIL_TEMPLATES = (
+    "activate_account_mail.html",
+    "forgot_password_mail.html",
+    "group_invitation_mail.html",
+    "group_invitation_mail_modern.html",
+)
+
+
+@lru_cache(maxsize=1)
+def get_logo_base64() -> str:
+    """Liest das SVG-Logo aus dem templates-Verzeichnis und kodiert es als Base64-String."""
+    logo_path = os.path.join(app.root_path, "templates", "prepper-app.svg")
+    with open(logo_path, "rb") as f:
+        encoded_logo = base64.b64encode(f.read()).decode("utf-8")
+    return encoded_logo
+
+
+@lru_cache(maxsize=None)
+def get_mail_template(template_name: str):
+    """Kompiliertes Jinja-Template, wird pro Prozess nur einmal geladen"""
+    return app.jinja_env.get_template(template_name)
+
+
+def render_mail(template_name: str, **context) -> str:
+    """Rendert eine E-Mail mit gecachtem Template und Logo.
+
+    Anders als render_template() laufen keine Kontextprozessoren und
+    Signale, und das Template wird nicht erneut auf Änderungen geprüft.
+    """
+    return get_mail_template(template_name).render(
+        logo_base64=get_logo_base64(),
+        current_year=datetime.now().year,
+        **context,
+    )
+
+
+def warm_mail_renderer():
+    """Lädt Logo und Mail-Templates beim Start vor"""
+    get_logo_base64()
+    for template_name in MAIL_TEMPLATES:
+        get_mail_template(template_name)
+
+
+warm_mail_renderer()
+
+
+def send_activation_email(user: User):
+    token = generate_token(user.email, salt="activate-account")
+    activation_url = url_for("activate_account", token=token, _external=True)
+    html = render_mail(
+        "activate_account_mail.html",
+        activation_url=activation_url,
+        username=user.username,
+    )
+    queue_email(user.email, "Aktivieren Sie Ihren Account", html)
+
+
+def send_forgot_password_email(user: User):
+    token = generate_token(user.email, salt="reset-password")
+    reset_url = url_for("reset_password", token=token, _external=True)
+    html = render_mail(
+        "forgot_password_mail.html",
+        reset_url=reset_url,
+        username=user.username,
+    )
+    queue_email(user.email, "Passwort zurücksetzen", html)
+
+
+def send_group_invitation_email_modern(invitation: GroupInvitation):
+    """Sendet eine E-Mail-Einladung für eine Gruppe mit neuem Token-System"""
+    group = invitation.group
+    inviter = invitation.inviter
+
+    # Verwende die vom Frontend bereitgestellte URL oder erstelle eine neue
+    if invitation.invite_url:
+        join_url = invitation.invite_url
+    else:
+        # Fallback: Erstelle URL mit neuem Format
+        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
+        join_url = f"{frontend_url}/invite/{invitation.invite_token}"
+    print(f"Join URL: {join_url}")
+    html = render_mail(
+        "group_invitation_mail_modern.html",  # Neues Template
+        inviter_name=inviter.username,
+        group_name=group.name,
+        group_description=group.description,
+        join_url=join_url,  # Neue URL mit /invite/:token
+        invite_code=group.invite_code,  # Alter Code als Fallback
+    )
+
+    queue_email(
+        invitation.invited_email,
+        f"Einladung zur Gruppe '{group.name}' - Prepper App",
+        html,
+    )
+
+
+def send_group_invitation_email(invitation: GroupInvitation):
+    """Sendet eine E-Mail-Einladung für eine Gruppe"""
+    group = invitation.group
+    inviter = invitation.inviter
+
+    # Join-URL erstellen
+    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
+    join_url = f"{frontend_url}/groups/join/{invitation.invite_token}"
+
+    html = render_mail(
+        "group_invitation_mail.html",
+        inviter_name=inviter.username,
+        group_name=group.name,
+        group_description=group.description,
+        join_url=join_url,
+        invite_code=group.invite_code,
+    )
+
+    queue_email(
+        invitation.invited_email,
+        f"Einladung zur Gruppe '{group.name}' - Prepper App",
+        html,
+    )
+
+
+### EMAIL OUTBOX ###
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_POLL_INTERVAL = 5  # Sekunden
+OUTBOX_LEASE = timedelta(minutes=5)
+
+
+def queue_email(recipient: str, subject: str, html_body: str):
+    """Legt eine E-Mail in der Outbox ab; sie wird mit der laufenden
+    Transaktion gespeichert und vom Mail-Worker zugestellt."""
+    db.session.add(
+        EmailOutbox(recipient=recipient, subject=subject, html_body=html_body)
+    )
+
+
+def outbox_backoff(attempts: int) -> timedelta:
+    """Exponentielles Backoff: 30s, 1min, 2min, ... höchstens 1h"""
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+
+def claim_outbox_batch(batch_size: int = OUTBOX_BATCH_SIZE) -> List[EmailOutbox]:
+    """Reserviert fällige E-Mails für diesen Worker.
+
+    next_attempt_at wird dabei um OUTBOX_LEASE verschoben, so dass parallele
+    Worker dieselbe E-Mail nicht doppelt versenden und ein abgestürzter
+    Worker sie nach Ablauf wieder freigibt.
+    """
+    now = datetime.now()
+    candidates = db.session.execute(
+        db.select(EmailOutbox.id, EmailOutbox.next_attempt_at)
+        .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(batch_size)
+    ).all()
+    claimed_ids = []
+    for outbox_id, next_attempt_at in candidates:
+        result = db.session.execute(
+            db.update(EmailOutbox)
+            .where(
+                EmailOutbox.id == outbox_id,
+                EmailOutbox.status == "pending",
+                EmailOutbox.next_attempt_at == next_attempt_at,
+            )
+            .values(next_attempt_at=now + OUTBOX_LEASE)
+        )
+        if result.rowcount == 1:
+            claimed_ids.append(outbox_id)
+    db.session.commit()
+    if not claimed_ids:
+        return []
+    return (
+        EmailOutbox.query.filter(EmailOutbox.id.in_(claimed_ids))
+        .order_by(EmailOutbox.id)
+        .all()
+    )
+
+
+def deliver_outbox(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Stellt einen Stapel fälliger E-Mails zu, gibt die Anzahl zurück"""
+    messages = claim_outbox_batch(batch_size)
+    batch = [
+        (message.recipient, message.subject, message.html_body) for message in messages
+    ]
+    # send_batch liefert die Ergebnisse einzeln, jede E-Mail wird sofort gespeichert
+    for message, (_, e) in zip(messages, mail_transport.send_batch(batch)):
+        message.attempts += 1
+        if e is not None:
+            message.last_error = str(e)[:1000]
+            if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                message.status = "failed"
+                print(
+                    f"E-Mail {message.id} an {message.recipient} endgültig fehlgeschlagen: {e}"
+                )
+            else:
+                message.next_attempt_at = datetime.now() + outbox_backoff(
+                    message.attempts
+                )
+                print(
+                    f"E-Mail {message.id} an {message.recipient} fehlgeschlagen, neuer Versuch später: {e}"
+                )
+        else:
+            message.status = "sent"
+            message.sent_at = datetime.now()
+            message.last_error = None
+            print(f"E-Mail erfolgreich an {message.recipient} gesendet.")
+        # Nach jeder E-Mail speichern, damit ein Absturz keine Doppelversendung auslöst
+        db.session.commit()
+    return len(messages)
+
+
+@app.cli.command("mail-worker")
+@click.option("--once", is_flag=True, help="Nur fällige E-Mails senden und beenden")
+def mail_worker_command(once):
+    """Stellt E-Mails aus der Outbox zu (läuft dauerhaft neben gunicorn)"""
+    print("Mail-Worker gestartet")
+    while True:
+        sent = deliver_outbox()
+        if once and sent == 0:
+            break
+        if sent == 0:
+            mail_transport.close_if_idle()
+            time.sleep(OUTBOX_POLL_INTERVAL)
+    mail_transport.close()
+
+
+def ensure_schema():
+    """Legt fehlende Spalten und Indizes in bestehenden Datenbanken an und
+    migriert Altdaten (doppelte Basket Items, name_key, Trigramme,
+    Kategorie-Zuordnungen, eingebettete Bilder).
+
+    db.create_all() erzeugt Indizes (inkl. Volltextindex) nur zusammen mit
+    neuen Tabellen. Alle Schritte sind idempotent; in Produktion läuft das
+    über ``flask ensure-schema`` vor dem Start von gunicorn.
+    """
+    # Vor dem Unique-Index auf (name, user_id) doppelte Einträge auflösen
+    merge_duplicate_basket_items()
+    # Vor dem Index auf (user_id, name_key) die Spalte nachrüsten
+    migrate_storage_item_name_keys()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        create_search_index(connection)
+    if not db.session.query(NameTrigram.id).first():
+        rebuild_name_trigrams()
+    migrate_item_categories()
+    migrate_inline_media()
+
+
+@app.cli.command("ensure-schema")
+def ensure_schema_command():
+    """Legt Tabellen und Indizes an und migriert bestehende Daten (vor dem
+    Start von gunicorn ausführen)"""
+    db.create_all()
+    ensure_schema()
+    print("Datenbankschema aktualisiert")
+
+
+### ROUTENDEFINITIONEN ###
+## AUTHENTICATION ##
+@app.route("/register", methods=["POST"])
+def register():
+    data = request.get_json()
+    if (
+        not data
+        or "username" not in data
+        or "password" not in data
+        or "email" not in data
+    ):
+        return jsonify({"error": "Invalid input"}), 400
+
+    # Sicherstellen, dass E-Mail noch nicht vergeben ist
+    if User.query.filter_by(email=data["email"].lower()).first():
+        return (
+            jsonify(
+                {"error": "Die E-Mail ist bereits mit einem anderen Account verknüpft."}
+            ),
+            409,
+        )
+
+    # Sicherstellen, dass Benutzername noch nicht vergeben ist
+    if User.query.filter_by(username=data["username"]).first():
+        return jsonify({"error": "Der Benutzername existiert bereits"}), 409
+
+    user = User(username=data["username"])
+    user.set_email(data["email"])
+    user.set_password(data["password"])
+    try:
+        user.image = store_media(data.get("image")) or None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    user.persons = data.get("persons") or 1
+    user.activated = False  # Account zunächst inaktiv
+    user.groups = []  # Keine Gruppen zu Beginn
+
+    # Aktivierungs-E-Mail wird mit dem User gespeichert und vom Mail-Worker versendet
+    db.session.add(user)
+    send_activation_email(user)
+    db.session.commit()
+    return (
+        user.__to_dict__(),
+        201,
+    )
+
+
+@app.route("/activate-account/<token>", methods=["GET"])
+def activate_account(token):
+    print("Aktivierungslink empfangen:", token)
+    try:
+        email = confirm_token(token, salt="activate-account")
+    except (SignatureExpired, BadSignature):
+        return jsonify({"error": "Aktivierungslink ungültig oder abgelaufen."}), 400
+
+    user = User.query.filter_by(email=email).first_or_404()
+    if not user.activated:
+        user.activated = True
+        db.session.commit()
+
+    access_token = create_access_token(identity=str(user.id))
+    refresh_token = create_refresh_token(identity=str(user.id))
+
+    response = make_response(
+        redirect(os.getenv("FRONTEND_URL", "http://192.168.178.79:3000"))
+    )
+    response.set_cookie("access_token", access_token, httponly=True, secure=True)
+    response.set_cookie("refresh_token", refresh_token, httponly=True, secure=True)
+    return response
+
+
+@app.route("/forgot-password", methods=["POST"])
+def forgot_password():
+    data = request.get_json()
+    if not data or "email" not in data:
+        return jsonify({"error": "Invalid input"}), 400
+
+    user = User.query.filter_by(email=data["email"].lower()).first()
+    if not user:
+        return jsonify({"error": "Kein Benutzer mit dieser E-Mail gefunden."}), 404
+
+    send_forgot_password_email(user)
+    db.session.commit()
+    return (
+        jsonify(
+            {"message": "Eine E-Mail zum Zurücksetzen des Passworts wurde gesendet."}
+        ),
+        200,
+    )
+
+
+@app.route("/reset-password/<token>", methods=["GET"])
+def reset_password_form(token):
+    try:
+        email = confirm_token(token, salt="reset-password")
+    except (SignatureExpired, BadSignature):
+        return jsonify({"error": "Link ungültig oder abgelaufen."}), 400
+
+    # Hier renderst du ein HTML-Formular, das das neue Passwort abfragt.
+    # Du kannst dafür ein Template (z. B. reset_password.html) nutzen.
+    return render_template("reset_password.html", token=token, email=email)
+
+
+@app.route("/reset-password/<token>", methods=["POST"])
+def reset_password(token):
+    # Verwende request.form.to_dict() als Fallback, wenn JSON-Daten nicht vorliegen.
+    data = request.form.to_dict() if request.form else (request.get_json() or {})
+    if not data or "password" not in data:
+        return jsonify({"error": "Invalid input"}), 400
+
+    try:
+        email = confirm_token(token, salt="reset-password")
+    except (SignatureExpired, BadSignature):
+        return jsonify({"error": "Link ungültig oder abgelaufen."}), 400
+
+    user = User.query.filter_by(email=email).first_or_404()
+    user.set_password(data["password"])
+    db.session.commit()
+
+    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
+    success_url = f"{frontend_url}/resetSuccess?resetSuccess=true&message=Passwort%20erfolgreich%20zurückgesetzt."
     return redirect(success_url)
 
 
@@ -909,7 +3281,7 @@ def login():
                 "id": user.id,
                 "username": user.username,
                 "email": user.email,
-                "image": user.image,
+                "image": media_url(user.image),
                 "persons": user.persons,
                 "access_token": access_token,
                 "refresh_token": refresh_token,
@@ -942,7 +3314,7 @@ def get_user():
                 "id": user.id,
                 "username": user.username,
                 "email": user.email.lower(),
-                "image": user.image,
+                "image": media_url(user.image),
                 "persons": user.persons,
                 "groups": [ug.group.name for ug in user.groups],
             }
@@ -981,12 +3353,16 @@ def update_user():
     # Bild als Base64-String verarbeiten
     image_data = data.get("image")
     if image_data and isinstance(image_data, str):
-        if image_data.startswith("data:image"):
-            # Direkt in der Datenbank speichern (Base64-String inklusive Data-URL-Präfix)
-            user.image = image_data
+        if image_data.startswith("data:image") or is_media_url(image_data):
+            # Bild im Blob-Store ablegen, am User nur die Referenz speichern
+            try:
+                user.image = store_media(image_data)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
         else:
             return jsonify({"error": "Invalid image format"}), 400
 
+    bump_data_version(user.id)
     db.session.commit()
     return (
         jsonify(
@@ -994,7 +3370,7 @@ def update_user():
                 "id": user.id,
                 "username": user.username,
                 "email": user.email,
-                "image": user.image,
+                "image": media_url(user.image),
                 "persons": user.persons,
                 "access_token": create_access_token(identity=str(user.id)),
                 "refresh_token": create_refresh_token(identity=str(user.id)),
@@ -1006,6 +3382,25 @@ def update_user():
     )
 
 
+@app.route("/user/image", methods=["PUT"])
+@jwt_required()
+def upload_user_image():
+    """Avatar als Datei hochladen (multipart/form-data oder image/* Body)"""
+    user_id = get_jwt_identity()
+    user = db.session.get(User, user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    ref, error = store_image_upload()
+    if error:
+        return error
+    user.image = ref
+
+    bump_data_version(user.id)
+    db.session.commit()
+    return jsonify(user.__to_dict__()), 200
+
+
 @app.route("/user", methods=["DELETE"])
 @jwt_required()
 def delete_user():
@@ -1025,27 +3420,50 @@ def get_user_groups():
     """Alle Gruppen des Users abrufen"""
     print("Get user groups called")
     user_id = get_jwt_identity()
-    user_groups = UserGroup.query.filter_by(user_id=user_id).all()
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    cached = not_modified(collection_etag("groups", user_id, accessible_user_ids))
+    if cached:
+        return cached
 
-    groups_data = []
-    for ug in user_groups:
-        group = ug.group
-        # Anzahl der Mitglieder zählen
-        member_count = len(group.members)
+    try:
+        fields = parse_fields(GROUP_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Mitgliederanzahl als Subquery statt len(group.members) pro Gruppe
+    member_count = (
+        db.session.query(func.count(UserGroup.id))
+        .filter(UserGroup.group_id == Group.id)
+        .correlate(Group)
+        .scalar_subquery()
+    )
+    query = (
+        db.session.query(UserGroup.role, Group, member_count)
+        .join(Group, UserGroup.group_id == Group.id)
+        .filter(UserGroup.user_id == user_id)
+    )
+    if fields is not None and "image" not in fields:
+        query = query.options(defer(Group.image))
 
-        groups_data.append(
-            {
-                "id": group.id,
-                "name": group.name,
-                "description": group.description,
-                "image": group.image,
-                "role": ug.role,
-                "memberCount": member_count,
-                "inviteCode": group.invite_code,
-                "isCreator": group.created_by == int(user_id),
-                "createdAt": group.created_at.isoformat() if group.created_at else None,
+    groups_data = []
+    for role, group, count in query.all():
+        group_data = {
+            "id": group.id,
+            "name": group.name,
+            "description": group.description,
+            "role": role,
+            "memberCount": count,
+            "inviteCode": group.invite_code,
+            "isCreator": group.created_by == int(user_id),
+            "createdAt": group.created_at.isoformat() if group.created_at else None,
+        }
+        if fields is None or "image" in fields:
+            group_data["image"] = media_url(group.image)
+        if fields is not None:
+            group_data = {
+                key: value for key, value in group_data.items() if key in fields
             }
-        )
+        groups_data.append(group_data)
 
     return jsonify(groups_data), 200
 
@@ -1069,7 +3487,12 @@ def create_group():
 
     image = data.get("image")
     if not image or not isinstance(image, str):
-        image = get_icon_as_base64("default_image.png")
+        image = default_icon_ref()
+    else:
+        try:
+            image = store_media(image)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
     # Neue Gruppe erstellen
     new_group = Group(
@@ -1086,6 +3509,7 @@ def create_group():
     user_group = UserGroup(user_id=int(user_id), group_id=new_group.id, role="admin")
 
     db.session.add(user_group)
+    bump_data_version(user_id)
     db.session.commit()
 
     return (
@@ -1094,7 +3518,7 @@ def create_group():
                 "id": new_group.id,
                 "name": new_group.name,
                 "description": new_group.description,
-                "image": new_group.image,
+                "image": media_url(new_group.image),
                 "inviteCode": new_group.invite_code,
                 "role": "admin",
                 "memberCount": 1,
@@ -1137,7 +3561,7 @@ def update_group(group_id):
                         header, encoded = image_data.split(",", 1)
                         image_bytes = base64.b64decode(encoded)
                         if len(image_bytes) <= 5 * 1024 * 1024:  # 5MB Limit
-                            group.image = image_data
+                            group.image = put_media_blob(image_bytes)
                         else:
                             return (
                                 jsonify({"error": "Image size exceeds 5MB limit"}),
@@ -1154,6 +3578,9 @@ def update_group(group_id):
                         ),
                         400,
                     )
+            elif is_media_url(image_data):
+                # Bereits gespeichertes Bild wird unverändert zurückgeschickt
+                group.image = store_media(image_data)
             elif image_data == "":
                 # Leerer String bedeutet Bild entfernen
                 group.image = None
@@ -1161,11 +3588,37 @@ def update_group(group_id):
             # None oder andere Werte bedeuten Bild entfernen
             group.image = None
 
+    bump_data_version(*get_group_user_ids(group_id))
     db.session.commit()
 
     return jsonify({"message": "Group updated successfully"}), 200
 
 
+@app.route("/groups/<int:group_id>/image", methods=["PUT"])
+@jwt_required()
+def upload_group_image(group_id):
+    """Gruppenbild als Datei hochladen (multipart/form-data oder image/* Body)"""
+    user_id = get_jwt_identity()
+    group = Group.query.get_or_404(group_id)
+
+    if group.created_by != int(user_id):
+        return jsonify({"error": "Only the group creator can update the group"}), 403
+
+    ref, error = store_image_upload()
+    if error:
+        return error
+    group.image = ref
+
+    bump_data_version(*get_group_user_ids(group_id))
+    db.session.commit()
+    return (
+        jsonify(
+            {"message": "Group updated successfully", "image": media_url(group.image)}
+        ),
+        200,
+    )
+
+
 @app.route("/groups/<int:group_id>", methods=["DELETE"])
 @jwt_required()
 def delete_group(group_id):
@@ -1177,6 +3630,10 @@ def delete_group(group_id):
     if group.created_by != int(user_id):
         return jsonify({"error": "Only the group creator can delete the group"}), 403
 
+    member_ids = get_group_user_ids(group_id)
+    bump_data_version(*member_ids)
+    log_membership_change(*member_ids)
+
     # Zuerst alle UserGroup Einträge löschen
     UserGroup.query.filter_by(group_id=group_id).delete()
 
@@ -1243,6 +3700,9 @@ def join_group_by_code(invite_code):
     user_group = UserGroup(user_id=int(user_id), group_id=group.id, role="member")
 
     db.session.add(user_group)
+    member_ids = [user_id, *get_group_user_ids(group.id)]
+    bump_data_version(*member_ids)
+    log_membership_change(*member_ids)
     db.session.commit()
 
     return (
@@ -1253,7 +3713,7 @@ def join_group_by_code(invite_code):
                     "id": group.id,
                     "name": group.name,
                     "description": group.description,
-                    "image": group.image,
+                    "image": media_url(group.image),
                     "role": "member",
                 },
             }
@@ -1324,7 +3784,7 @@ def invite_to_group(group_id):
     if not user_group or user_group.role not in ["admin", "creator"]:
         return jsonify({"error": "Only group admins can invite users"}), 403
 
-    group = Group.query.get_or_404(group_id)
+    Group.query.get_or_404(group_id)
     invited_email = data["invitedEmail"].lower()
 
     # Neue Token-System Integration
@@ -1358,13 +3818,11 @@ def invite_to_group(group_id):
     )
 
     db.session.add(invitation)
-    db.session.commit()
+    db.session.flush()
 
-    # E-Mail senden mit neuer URL
-    try:
-        send_group_invitation_email_modern(invitation)
-    except Exception as e:
-        print(f"Fehler beim Senden der Einladungs-E-Mail: {e}")
+    # E-Mail mit neuer URL wird zusammen mit der Einladung gespeichert
+    send_group_invitation_email_modern(invitation)
+    db.session.commit()
 
     return (
         jsonify(
@@ -1419,6 +3877,9 @@ def join_group_via_invitation(invite_token):
     invitation.accepted_at = datetime.utcnow()
 
     db.session.add(user_group)
+    member_ids = [user_id, *get_group_user_ids(group.id)]
+    bump_data_version(*member_ids)
+    log_membership_change(*member_ids)
     db.session.commit()
 
     print(f"User {user_id} erfolgreich der Gruppe {group.name} hinzugefügt")
@@ -1432,7 +3893,7 @@ def join_group_via_invitation(invite_token):
                     "id": group.id,
                     "name": group.name,
                     "description": group.description,
-                    "image": group.image,
+                    "image": media_url(group.image),
                     "role": "member",
                 },
             }
@@ -1500,6 +3961,9 @@ def remove_user_from_group(group_id, user_id):
     if not user_to_remove:
         return jsonify({"error": "User is not a member of this group"}), 404
 
+    member_ids = get_group_user_ids(group_id)
+    bump_data_version(*member_ids)
+    log_membership_change(*member_ids)
     db.session.delete(user_to_remove)
     db.session.commit()
 
@@ -1529,6 +3993,9 @@ def leave_group(group_id):
             400,
         )
 
+    member_ids = get_group_user_ids(group_id)
+    bump_data_version(*member_ids)
+    log_membership_change(*member_ids)
     db.session.delete(user_group)
     db.session.commit()
 
@@ -1543,24 +4010,50 @@ def get_basket():
 
     # Alle User-IDs von Gruppenmitgliedern abrufen
     accessible_user_ids = get_group_member_ids(int(user_id))
-    items = (
-        db.session.query(BasketItem)
-        .filter(BasketItem.user_id.in_(accessible_user_ids))
-        .all()
+    cached = not_modified(collection_etag("basket", user_id, accessible_user_ids))
+    if cached:
+        return cached
+
+    try:
+        fields = parse_fields(BASKET_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = db.session.query(BasketItem).filter(
+        BasketItem.user_id.in_(accessible_user_ids)
     )
+    if fields is None or "categories" in fields:
+        query = query.options(
+            selectinload(BasketItem.linked_categories).load_only(Category.name)
+        )
+    query = filter_by_category(query, BasketItem, basket_item_category.c.basket_item_id)
+    if fields is not None and "icon" not in fields:
+        query = query.options(defer(BasketItem.icon))
+
+    searchstring = request.args.get("q", "")
+    if searchstring and wants_fuzzy_search():
+        query = apply_fuzzy_search(
+            query, BasketItem, searchstring, ranked=not wants_pagination()
+        )
+    elif searchstring:
+        query = query.filter(
+            func.lower(BasketItem.name).like(f"%{searchstring.lower()}%")
+        )
+
+    next_cursor = None
+    if wants_pagination():
+        try:
+            items, next_cursor = paginate_keyset(query, BasketItem)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        items = query.all()
+
+    basket = [serialize_basket_item(item, fields) for item in items]
+    if wants_pagination():
+        basket = {"items": basket, "next_cursor": next_cursor}
     return (
-        jsonify(
-            [
-                {
-                    "id": item.id,
-                    "name": item.name,
-                    "amount": item.amount,
-                    "categories": item.categories.split(",") if item.categories else [],
-                    "icon": item.icon,
-                }
-                for item in items
-            ]
-        ),
+        jsonify(basket),
         200,
         {"Content-Type": "application/json"},
     )
@@ -1574,37 +4067,44 @@ def add_basket_item():
     if not data:
         return jsonify({"error": "Invalid input data"}), 400
 
-    item = (
-        db.session.query(BasketItem)
-        .filter_by(name=data["name"], user_id=user_id)
-        .first()
-    )
-    if item is None:
-        item = BasketItem(
-            name=data["name"],
-            amount=1,
-            categories=",".join(data.get("categories", [])),
-            icon=data.get("icon"),
-            user_id=user_id,
+    try:
+        icon = store_media(data.get("icon"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Insert-or-increment über den Unique-Key (name, user_id): vorhandenes
+    # Item atomar erhöhen, sonst einfügen; verliert das INSERT gegen einen
+    # parallelen Request, wird dessen Item erhöht
+    item_id = increment_basket_item(data["name"], user_id)
+    if item_id is None:
+        item_id = insert_basket_item(
+            {
+                "name": data["name"],
+                "amount": 1,
+                "categories": ",".join(data.get("categories", [])),
+                "icon": icon,
+                "user_id": int(user_id),
+            }
         )
-        db.session.add(item)
-    else:
-        item.amount = item.amount + 1
+        if item_id is None:
+            item_id = increment_basket_item(data["name"], user_id)
+        else:
+            # Der Core-Insert umgeht die ORM-Events des Trigramm-Index
+            index_name_trigrams(
+                db.session.connection(), "basket", item_id, data["name"]
+            )
+            link_categories(
+                basket_item_category.c.basket_item_id,
+                {item_id: data.get("categories", [])},
+                user_id,
+            )
+    item = db.session.get(BasketItem, item_id, populate_existing=True)
 
-    db.session.commit()
+    log_change("basket", [item.id], item.user_id)
+    bump_data_version(item.user_id)
+    commit_changes()
     # rückgabe des datensatzes als bestätigung
-    return (
-        jsonify(
-            {
-                "id": item.id,
-                "name": item.name,
-                "amount": item.amount,
-                "categories": item.categories.split(",") if item.categories else [],
-                "icon": item.icon,
-            }
-        ),
-        201,
-    )
+    return jsonify(serialize_basket_item(item)), 201
 
 
 @app.route("/basket/<int:item_id>", methods=["PUT"])
@@ -1614,6 +4114,11 @@ def update_basket_item(item_id):
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid input data"}), 400
+    # PUT ersetzt das Item, ohne Namen würde der Unique-Key als 409 gemeldet
+    if not isinstance(data.get("name"), str) or not data["name"].strip():
+        return jsonify({"error": "name is required"}), 400
+    if data.get("amount") is None:
+        return jsonify({"error": "amount is required"}), 400
 
     item = db.session.get(BasketItem, item_id)
     if not item:
@@ -1628,24 +4133,64 @@ def update_basket_item(item_id):
     item.amount = data["amount"]
     if "categories" in data:
         item.categories = ",".join(data.get("categories", []))
-    item.icon = data.get("icon")
+        link_categories(
+            basket_item_category.c.basket_item_id,
+            {item.id: data.get("categories", [])},
+            user_id,
+        )
+        db.session.expire(item, ["linked_categories"])
+    try:
+        item.icon = store_media(data.get("icon"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     item.name = data.get("name")
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Umbenennen auf einen vorhandenen Namen (Unique-Key name, user_id)
+        db.session.rollback()
+        return jsonify({"error": "Basket item with the same name already exists"}), 409
 
+    # Vor dem Löschen serialisieren, danach sind die Kategorien nicht mehr ladbar
+    result = serialize_basket_item(item)
     if int(item.amount) < 1:
         db.session.delete(item)
-    db.session.commit()
-    return (
-        jsonify(
-            {
-                "id": item.id,
-                "name": item.name,
-                "amount": item.amount,
-                "categories": item.categories.split(",") if item.categories else [],
-                "icon": item.icon,
-            }
-        ),
-        201,
-    )
+        log_change("basket", [item.id], item.user_id, op="delete")
+    else:
+        log_change("basket", [item.id], item.user_id)
+    bump_data_version(item.user_id)
+    commit_changes()
+    return jsonify(result), 201
+
+
+@app.route("/basket/<int:item_id>", methods=["PATCH"])
+@jwt_required()
+def patch_basket_item(item_id):
+    """Ändert die Menge atomar um ``delta``; bei Menge < 1 wird das Item entfernt"""
+    user_id = get_jwt_identity()
+    try:
+        delta = parse_amount_delta(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    row = apply_amount_delta(BasketItem, item_id, delta, accessible_user_ids)
+    if row is None:
+        if db.session.get(BasketItem, item_id) is None:
+            return jsonify({"error": "Item not found"}), 404
+        return jsonify({"error": "Unauthorized"}), 403
+
+    item = db.session.get(BasketItem, item_id, populate_existing=True)
+    result = serialize_basket_item(item)
+    if row.amount < 1:
+        result["amount"] = 0
+        db.session.delete(item)
+        log_change("basket", [item_id], row.user_id, op="delete")
+    else:
+        log_change("basket", [item_id], row.user_id)
+    bump_data_version(row.user_id)
+    commit_changes()
+    return jsonify(result), 200
 
 
 @app.route("/basket/<int:item_id>", methods=["DELETE"])
@@ -1657,24 +4202,275 @@ def delete_basket_item(item_id):
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
-    # Prüfen ob der User berechtigt ist (Besitzer oder Gruppenmitglied)
-    accessible_user_ids = get_group_member_ids(int(user_id))
-    if item.user_id not in accessible_user_ids:
-        return jsonify({"error": "Unauthorized"}), 403
+    # Prüfen ob der User berechtigt ist (Besitzer oder Gruppenmitglied)
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    if item.user_id not in accessible_user_ids:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    result = dict(serialize_basket_item(item), amount=0)
+    print("Delete item")
+    db.session.delete(item)
+    print("Commit")
+    log_change("basket", [item.id], item.user_id, op="delete")
+    bump_data_version(item.user_id)
+    commit_changes()
+    print("Return")
+    return jsonify(result), 200
+
+
+@app.route("/basket/checkout", methods=["POST"])
+@jwt_required()
+def checkout_basket():
+    """Übernimmt gekaufte Basket Items ins Lager.
+
+    Gleichnamige StorageItems der Gruppe werden um die Menge erhöht,
+    fehlende mit Standardwerten angelegt und die Basket Items entfernt,
+    alles set-basiert in einer Transaktion.
+    """
+    user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    basket_ids = data.get("ids")
+    if basket_ids is not None and (
+        not isinstance(basket_ids, list)
+        or not all(type(item_id) is int for item_id in basket_ids)
+    ):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    unit = data.get("unit") or CHECKOUT_DEFAULT_UNIT
+    storage_location = data.get("storageLocation")
+    lowest_amount = data.get("lowestAmount", 0)
+    mid_amount = data.get("midAmount", 0)
+    if not isinstance(unit, str):
+        return jsonify({"error": "unit must be a string"}), 400
+    if storage_location is not None and not isinstance(storage_location, str):
+        return jsonify({"error": "storageLocation must be a string"}), 400
+    if not is_integer(lowest_amount) or not is_integer(mid_amount):
+        return jsonify({"error": "lowestAmount and midAmount must be integers"}), 400
+
+    accessible_user_ids = get_group_member_ids(user_id)
+    query = (
+        db.session.query(BasketItem)
+        .options(selectinload(BasketItem.linked_categories).load_only(Category.name))
+        .filter(BasketItem.user_id.in_(accessible_user_ids))
+    )
+    if basket_ids is not None:
+        query = query.filter(BasketItem.id.in_(basket_ids))
+    basket = query.order_by(BasketItem.id).all()
+    if basket_ids is not None and len(basket) != len(set(basket_ids)):
+        return jsonify({"error": "Item not found"}), 404
+
+    # Mengen pro StorageItem bzw. pro neuem Namen zusammenfassen
+    matches = match_storage_items(
+        [item.name for item in basket], accessible_user_ids, user_id
+    )
+    increments = {}
+    new_items = {}
+    for item in basket:
+        amount = item.amount or 1
+        key = item_name_key(item.name)
+        if key in matches:
+            item_id = matches[key][0]
+            increments[item_id] = increments.get(item_id, 0) + amount
+        elif key in new_items:
+            new_items[key][0]["amount"] += amount
+        else:
+            categories = [category.name for category in item.linked_categories]
+            mapping = {
+                "name": item.name,
+                "amount": amount,
+                "categories": ",".join(categories),
+                "lowestAmount": lowest_amount,
+                "midAmount": mid_amount,
+                "unit": unit,
+                "packageQuantity": None,
+                "packageUnit": None,
+                "storageLocation": storage_location,
+                "icon": item.icon,
+                "user_id": user_id,
+            }
+            new_items[key] = (mapping, {"categories": categories})
+
+    if new_items and not storage_location:
+        # Neue StorageItems brauchen wie überall sonst einen Lagerort
+        return (
+            jsonify(
+                {
+                    "error": "storageLocation is required to create new items",
+                    "missing": [mapping["name"] for mapping, _ in new_items.values()],
+                }
+            ),
+            400,
+        )
+
+    if any(not mapping["icon"] for mapping, _ in new_items.values()):
+        default_icon = default_icon_ref()
+        for mapping, _ in new_items.values():
+            mapping["icon"] = mapping["icon"] or default_icon
+
+    increment_storage_amounts(increments)
+    updated_by_owner = {}
+    for item_id, owner_id in matches.values():
+        if item_id in increments:
+            updated_by_owner.setdefault(owner_id, []).append(item_id)
+    for owner_id, item_ids in updated_by_owner.items():
+        log_change("item", item_ids, owner_id)
+
+    created_ids = []
+    if new_items:
+        try:
+            created_ids = write_item_batch(
+                [mapping for mapping, _ in new_items.values()],
+                [payload for _, payload in new_items.values()],
+                user_id,
+                "insert",
+            )
+        except IntegrityError:
+            db.session.rollback()
+            return (
+                jsonify(
+                    {
+                        "error": "Item with the same name, storageLocation, and unit already exists."
+                    }
+                ),
+                409,
+            )
+
+    removed_by_owner = {}
+    for item in basket:
+        removed_by_owner.setdefault(item.user_id, []).append(item.id)
+    removed_ids = [item.id for item in basket]
+    delete_basket_items(removed_ids)
+    for owner_id, item_ids in removed_by_owner.items():
+        log_change("basket", item_ids, owner_id, op="delete")
+
+    bump_data_version(*updated_by_owner, *removed_by_owner)
+    commit_changes()
+    return (
+        jsonify(
+            {
+                "message": "Basket checked out successfully",
+                "updated": sorted(increments),
+                "created": created_ids,
+                "removed": removed_ids,
+            }
+        ),
+        200,
+    )
+
+
+## SYNC ##
+@app.route("/sync", methods=["GET"])
+@jwt_required()
+def sync_changes():
+    """Liefert alle Änderungen an Items und Basket seit ``?since=<seq>``"""
+    user_id = get_jwt_identity()
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid since"}), 400
+
+    compacted_seq = db.session.query(
+        func.max(ChangeLogCompaction.compacted_seq)
+    ).scalar()
+    latest_seq = max(
+        db.session.query(func.max(ChangeLog.seq)).scalar() or 0, compacted_seq or 0
+    )
+    if compacted_seq is not None and since < compacted_seq:
+        # Zwischenstände wurden kompaktiert: Client muss komplett neu laden
+        return (
+            jsonify(
+                {"error": "Sync state expired", "reset": True, "cursor": latest_seq}
+            ),
+            410,
+        )
+
+    membership_changed = (
+        db.session.query(ChangeLog.seq)
+        .filter(
+            ChangeLog.user_id == int(user_id),
+            ChangeLog.entity == "membership",
+            ChangeLog.seq > since,
+        )
+        .first()
+    )
+    if since and membership_changed:
+        # Beitritt/Austritt ändert die sichtbaren Besitzer, deren ältere
+        # Änderungen der Client nie bekommen hat: komplett neu laden
+        return (
+            jsonify(
+                {
+                    "error": "Group membership changed",
+                    "reset": True,
+                    "cursor": latest_seq,
+                }
+            ),
+            410,
+        )
+
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    entries = (
+        db.session.query(ChangeLog)
+        .filter(
+            ChangeLog.user_id.in_(accessible_user_ids),
+            ChangeLog.entity != "membership",
+            ChangeLog.seq > since,
+        )
+        .order_by(ChangeLog.seq)
+        .limit(SYNC_PAGE_SIZE + 1)
+        .all()
+    )
+    has_more = len(entries) > SYNC_PAGE_SIZE
+    entries = entries[:SYNC_PAGE_SIZE]
+
+    # Nur der jüngste Eintrag pro Item zählt
+    latest_ops = {}
+    for entry in entries:
+        latest_ops[(entry.entity, entry.entity_id)] = entry.op
+    changed = {
+        entity: [
+            eid for (e, eid), op in latest_ops.items() if e == entity and op != "delete"
+        ]
+        for entity in ("item", "basket")
+    }
+    deleted = {
+        entity: [
+            eid for (e, eid), op in latest_ops.items() if e == entity and op == "delete"
+        ]
+        for entity in ("item", "basket")
+    }
+
+    items = []
+    if changed["item"]:
+        items = (
+            inventory_query(accessible_user_ids)
+            .filter(StorageItem.id.in_(changed["item"]))
+            .all()
+        )
+    basket = []
+    if changed["basket"]:
+        basket = (
+            db.session.query(BasketItem)
+            .options(
+                selectinload(BasketItem.linked_categories).load_only(Category.name)
+            )
+            .filter(
+                BasketItem.id.in_(changed["basket"]),
+                BasketItem.user_id.in_(accessible_user_ids),
+            )
+            .all()
+        )
+
+    # Inzwischen gelöschte Items ohne eigenen Eintrag auf dieser Seite
+    deleted["item"] += sorted(set(changed["item"]) - {item.id for item in items})
+    deleted["basket"] += sorted(set(changed["basket"]) - {item.id for item in basket})
 
-    print("Delete item")
-    db.session.delete(item)
-    print("Commit")
-    db.session.commit()
-    print("Return")
     return (
         jsonify(
             {
-                "id": item.id,
-                "name": item.name,
-                "amount": 0,
-                "categories": item.categories.split(",") if item.categories else [],
-                "icon": item.icon,
+                "items": [serialize_storage_item(item, int(user_id)) for item in items],
+                "basket": [serialize_basket_item(item) for item in basket],
+                "deleted": {"items": deleted["item"], "basket": deleted["basket"]},
+                "cursor": entries[-1].seq if entries else max(since, latest_seq),
+                "hasMore": has_more,
             }
         ),
         200,
@@ -1688,89 +4484,90 @@ def add_bulk_items():
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid input data"}), 400
+    mode = request.args.get("mode", "insert")
+    if mode not in ("insert", "upsert"):
+        return jsonify({"error": "mode must be 'insert' or 'upsert'"}), 400
 
     # Überprüfe die notwendigen Felder und sammle Mappings für StorageItem
     mappings = []
+    payloads = []
     for item_data in data:
-        required_keys = [
-            "name",
-            "amount",
-            "unit",
-            "storageLocation",
-            "lowestAmount",
-            "midAmount",
-        ]
-        if not all(key in item_data and item_data[key] != "" for key in required_keys):
-            return jsonify({"error": "Invalid input data for one or more items"}), 400
-
-        mapping = {
-            "name": item_data["name"],
-            "amount": item_data["amount"],
-            "categories": ",".join(item_data.get("categories", [])),
-            "lowestAmount": item_data["lowestAmount"],
-            "midAmount": item_data["midAmount"],
-            "unit": item_data["unit"],
-            "packageQuantity": item_data.get("packageQuantity"),
-            "packageUnit": item_data.get("packageUnit"),
-            "storageLocation": item_data["storageLocation"],
-            "icon": item_data.get("icon"),
-            "user_id": user_id,
-        }
-        # Wenn kein Icon vorhanden, versuche es über SerpAPI zu ermitteln
-        if not mapping["icon"]:
-            mapping["icon"] = get_icon_from_serpapi(mapping["name"])
-        mappings.append(mapping)
-
-    # Phase 1: Bulk-Insert für StorageItem
-    mapper: Mapper = cast(Mapper, inspect(StorageItem))
-    db.session.bulk_insert_mappings(mapper, mappings)
+        try:
+            mappings.append(build_item_mapping(item_data, user_id))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        payloads.append(item_data)
+
+    if mode == "upsert":
+        mappings, payloads = dedupe_item_batch(mappings, payloads)
+        keep_existing_icons(mappings, user_id)
+
+    # Fehlende Icons parallel über SerpAPI ermitteln, nicht rechtzeitig
+    # gefundene bekommen das Standard-Icon
+    missing = [mapping["name"] for mapping in mappings if mapping["icon"] == ""]
+    if missing:
+        icons = resolve_icons(missing)
+        for mapping in mappings:
+            if mapping["icon"] == "":
+                key = normalize_icon_name(mapping["name"])
+                mapping["icon"] = icons.get(key) or default_icon_ref()
 
+    try:
+        item_ids = write_item_batch(mappings, payloads, user_id, mode)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return (
+            jsonify(
+                {
+                    "error": "Item with the same name, storageLocation, and unit already exists."
+                }
+            ),
+            409,
+        )
     db.session.commit()
+    if mode == "upsert":
+        return (
+            jsonify({"message": "Items upserted successfully", "ids": item_ids}),
+            200,
+        )
+    return jsonify({"message": "Items added successfully"}), 201
 
-    # Phase 2: Verarbeite Nutrient-Daten für jedes Item
-    for item_data in data:
-        new_item = StorageItem.query.filter_by(
-            name=item_data["name"],
-            storageLocation=item_data["storageLocation"],
-            unit=item_data["unit"],
-            user_id=user_id,
-        ).first()
-        if new_item is None:
-            return jsonify({"error": f"Item {item_data['name']} not found."}), 404
-
-        if "nutrients" in item_data and item_data["nutrients"]:
-            nutrient_data = item_data["nutrients"]
-            nutrient = Nutrient(
-                description=nutrient_data["description"],
-                unit=nutrient_data["unit"],
-                amount=nutrient_data["amount"],
-                storage_item_id=new_item.id,
-                user_id=user_id,
-            )
-            db.session.add(nutrient)
-            db.session.flush()  # Zuweisung der nutrient.id
-
-            for value_data in nutrient_data.get("values", []):
-                nutrient_value = NutrientValue(
-                    name=value_data["name"],
-                    color=value_data.get("color"),
-                    nutrient_id=nutrient.id,
-                    user_id=user_id,
-                )
-                db.session.add(nutrient_value)
-                db.session.flush()  # nutrient_value.id zuweisen
-
-                for type_data in value_data.get("values", []):
-                    nutrient_type = NutrientType(
-                        typ=type_data["typ"],
-                        value=type_data["value"],
-                        nutrient_value_id=nutrient_value.id,
-                        user_id=user_id,
-                    )
-                    db.session.add(nutrient_type)
 
-    db.session.commit()
-    return jsonify({"message": "Items added successfully"}), 201
+@app.route("/items/import", methods=["POST"])
+@jwt_required()
+def import_items():
+    """Importiert Items aus NDJSON (eine Item-Zeile pro Zeile, optional gzip).
+
+    Die Zeilen werden einzeln gelesen und validiert und in Chunks von
+    IMPORT_CHUNK_SIZE geschrieben und committet. Ungültige Zeilen landen im
+    Fehlerbericht, der Rest wird trotzdem importiert.
+    """
+    user_id = get_jwt_identity()
+    mode = request.args.get("mode", "insert")
+    if mode not in ("insert", "upsert"):
+        return jsonify({"error": "mode must be 'insert' or 'upsert'"}), 400
+
+    report = ImportReport()
+    chunk = []
+    try:
+        for line_number, item_data in read_ndjson_upload(report):
+            try:
+                mapping = build_item_mapping(item_data, user_id, default_icon=True)
+            except (ValueError, TypeError, KeyError) as e:
+                report.fail(line_number, str(e))
+                continue
+            chunk.append((line_number, mapping, item_data))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                import_item_chunk(chunk, user_id, mode, report)
+                chunk = []
+        if chunk:
+            import_item_chunk(chunk, user_id, mode, report)
+    except ValueError as e:
+        # Upload nicht lesbar (z.B. kaputtes gzip): bisherige Chunks bleiben
+        report.fail(None, str(e))
+    return jsonify(report.to_dict()), 200
 
 
 ## ITEMS ##
@@ -1782,60 +4579,88 @@ def get_items():
 
     # Alle User-IDs aus den gleichen Gruppen holen
     accessible_user_ids = get_group_member_ids(int(user_id))
+    cached = not_modified(collection_etag("items", user_id, accessible_user_ids))
+    if cached:
+        return cached
 
-    query = StorageItem.query.filter(StorageItem.user_id.in_(accessible_user_ids))
+    try:
+        fields = parse_fields(ITEM_FIELDS)
+        query = inventory_query(accessible_user_ids, fields)
+        query = filter_by_stock_status(query, request.args.get("status"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = filter_by_category(
+        query, StorageItem, storage_item_category.c.storage_item_id
+    )
 
     if searchstring:
-        from sqlalchemy import func
+        # Bei Pagination bestimmt die Keyset-Sortierung die Reihenfolge
+        if wants_fuzzy_search():
+            query = apply_fuzzy_search(
+                query, StorageItem, searchstring, ranked=not wants_pagination()
+            )
+        else:
+            query = apply_item_search(
+                query, searchstring, ranked=not wants_pagination()
+            )
 
-        query = query.filter(
-            func.lower(StorageItem.name).like(f"%{searchstring.lower()}%")
+    if wants_ndjson_stream():
+        return stream_ndjson(
+            query.order_by(StorageItem.id),
+            lambda item: serialize_storage_item(item, int(user_id), fields),
         )
 
-    items = query.all()
+    next_cursor = None
+    if wants_pagination():
+        try:
+            items, next_cursor = paginate_keyset(query, StorageItem)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        items = query.all()
+
+    result = [serialize_storage_item(item, int(user_id), fields) for item in items]
+    if wants_pagination():
+        result = {"items": result, "next_cursor": next_cursor}
+    return (
+        jsonify(result),
+        200,
+        {"Content-Type": "application/json"},
+    )
+
+
+@app.route("/items/low-stock", methods=["GET"])
+@jwt_required()
+def get_low_stock_items():
+    """Nur Items mit niedrigem oder mittlerem Bestand, klassifiziert in SQL"""
+    user_id = get_jwt_identity()
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    cached = not_modified(collection_etag("low-stock", user_id, accessible_user_ids))
+    if cached:
+        return cached
+
+    status = stock_status_expression().label("status")
+    try:
+        fields = parse_fields(ITEM_FIELDS)
+        query = inventory_query(accessible_user_ids, fields)
+        query = filter_by_stock_status(
+            query,
+            request.args.get("status") or ",".join(LOW_STOCK_STATUSES),
+            allowed=LOW_STOCK_STATUSES,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    rows = query.add_columns(status).order_by(status, StorageItem.name).all()
     return (
         jsonify(
             [
-                {
-                    "id": item.id,
-                    "name": item.name,
-                    "amount": item.amount,
-                    "categories": item.categories.split(",") if item.categories else [],
-                    "lowestAmount": item.lowestAmount,
-                    "midAmount": item.midAmount,
-                    "unit": item.unit,
-                    "packageQuantity": item.packageQuantity,
-                    "packageUnit": item.packageUnit,
-                    "storageLocation": item.storageLocation,
-                    "icon": item.icon,
-                    "owner": item.user.username,  # Zeige den Besitzer des Items
-                    "isOwner": item.user_id
-                    == int(user_id),  # Zeige ob der aktuelle User der Besitzer ist
-                    "nutrients": (
-                        {
-                            "id": item.nutrient.id,
-                            "description": item.nutrient.description,
-                            "unit": item.nutrient.unit,
-                            "amount": item.nutrient.amount,
-                            "values": [
-                                {
-                                    "id": v.id,
-                                    "name": v.name,
-                                    "color": v.color,
-                                    "values": [
-                                        {"typ": t.typ, "value": t.value}
-                                        for t in v.values
-                                    ],
-                                }
-                                for v in item.nutrient.values
-                            ],
-                        }
-                        if item.nutrient
-                        else None
-                    ),
-                }
-                for item in items
+                dict(
+                    serialize_storage_item(item, int(user_id), fields),
+                    status=item_status,
+                )
+                for item, item_status in rows
             ]
         ),
         200,
@@ -1843,6 +4668,87 @@ def get_items():
     )
 
 
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": NDJSON_MIMETYPE}
+EXPORT_CSV_COLUMNS = (
+    "id",
+    "name",
+    "amount",
+    "lowestAmount",
+    "midAmount",
+    "unit",
+    "packageQuantity",
+    "packageUnit",
+    "storageLocation",
+    "categories",
+    "owner",
+)
+
+
+@app.route("/items/export", methods=["GET"])
+@jwt_required()
+def export_items():
+    """Exportiert das sichtbare Inventar als CSV oder NDJSON.
+
+    Die Items werden mit yield_per batchweise vom Cursor gelesen und direkt
+    gestreamt (bei ``Accept-Encoding: gzip`` komprimiert), der
+    Speicherbedarf hängt nicht von der Größe des Inventars ab. Icons und
+    Nährwerte nur mit ``?icons=1`` bzw. ``?nutrients=1``.
+    """
+    user_id = int(get_jwt_identity())
+    export_format = request.args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be 'csv' or 'ndjson'"}), 400
+
+    fields = set(EXPORT_CSV_COLUMNS)
+    if request.args.get("icons") in ("1", "true"):
+        fields.add("icon")
+    if request.args.get("nutrients") in ("1", "true"):
+        fields.add("nutrients")
+    columns = list(EXPORT_CSV_COLUMNS) + [
+        column for column in ("icon", "nutrients") if column in fields
+    ]
+
+    query = (
+        inventory_query(get_group_member_ids(user_id), fields)
+        .order_by(StorageItem.id)
+        .yield_per(STREAM_BATCH_SIZE)
+    )
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(columns)
+        for index, item in enumerate(query, 1):
+            data = serialize_storage_item(item, user_id, fields)
+            if export_format == "csv":
+                data["categories"] = ", ".join(data["categories"])
+                if data.get("nutrients") is not None:
+                    data["nutrients"] = app.json.dumps(data["nutrients"])
+                writer.writerow([data.get(column) for column in columns])
+            else:
+                buffer.write(app.json.dumps(data) + "\n")
+            if index % STREAM_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    chunks = generate()
+    headers = {
+        "Content-Disposition": f'attachment; filename="inventory.{export_format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if wants_gzip():
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers=headers,
+    )
+
+
 @app.route("/items", methods=["POST"])
 @jwt_required()
 def add_item():
@@ -1884,16 +4790,24 @@ def add_item():
         packageQuantity=data.get("packageQuantity"),
         packageUnit=data.get("packageUnit"),
         storageLocation=data["storageLocation"],
-        icon=data.get("icon"),
         user_id=user_id,
     )
 
+    try:
+        new_item.icon = store_media(data.get("icon"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     if not new_item.icon or new_item.icon == "":
-        # setze prepper-app.svg als Standard-Icon in base64
-        new_item.icon = get_icon_as_base64("default_image.png")
+        # Standard-Icon wird nur einmal im Blob-Store abgelegt
+        new_item.icon = default_icon_ref()
 
     db.session.add(new_item)
     db.session.flush()  # new_item.id verfügbar
+    link_categories(
+        storage_item_category.c.storage_item_id,
+        {new_item.id: data.get("categories", [])},
+        user_id,
+    )
 
     if "nutrients" in data and data["nutrients"]:
         nutrient_data = data["nutrients"]
@@ -1923,48 +4837,12 @@ def add_item():
                     user_id=user_id,
                 )
                 db.session.add(nutrient_type)
-    db.session.commit()
-    return (
-        jsonify(
-            {
-                "id": new_item.id,
-                "name": new_item.name,
-                "amount": new_item.amount,
-                "categories": (
-                    new_item.categories.split(",") if new_item.categories else []
-                ),
-                "lowestAmount": new_item.lowestAmount,
-                "midAmount": new_item.midAmount,
-                "unit": new_item.unit,
-                "packageQuantity": new_item.packageQuantity,
-                "packageUnit": new_item.packageUnit,
-                "storageLocation": new_item.storageLocation,
-                "icon": new_item.icon,
-                "nutrients": (
-                    {
-                        "id": new_item.nutrient.id,
-                        "description": new_item.nutrient.description,
-                        "unit": new_item.nutrient.unit,
-                        "amount": new_item.nutrient.amount,
-                        "values": [
-                            {
-                                "id": v.id,
-                                "name": v.name,
-                                "color": v.color,
-                                "values": [
-                                    {"typ": t.typ, "value": t.value} for t in v.values
-                                ],
-                            }
-                            for v in new_item.nutrient.values
-                        ],
-                    }
-                    if new_item.nutrient
-                    else None
-                ),
-            }
-        ),
-        201,
-    )
+    log_change("item", [new_item.id], new_item.user_id)
+    bump_data_version(new_item.user_id)
+    commit_changes()
+
+    new_item = get_inventory_item(new_item.id)
+    return jsonify(serialize_storage_item(new_item)), 201
 
 
 @app.route("/items/<int:item_id>", methods=["PUT"])
@@ -1975,7 +4853,7 @@ def update_item(item_id):
     if not data:
         return jsonify({"error": "Invalid input data"}), 400
 
-    item = db.session.get(StorageItem, item_id)
+    item = get_inventory_item(item_id)
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
@@ -1988,100 +4866,94 @@ def update_item(item_id):
     item.amount = data.get("amount", item.amount)
     if "categories" in data:
         item.categories = ",".join(data.get("categories", []))
+        link_categories(
+            storage_item_category.c.storage_item_id,
+            {item.id: data.get("categories", [])},
+            user_id,
+        )
     item.lowestAmount = data.get("lowestAmount", item.lowestAmount)
     item.midAmount = data.get("midAmount", item.midAmount)
     item.unit = data.get("unit", item.unit)
     item.packageQuantity = data.get("packageQuantity", item.packageQuantity)
     item.packageUnit = data.get("packageUnit", item.packageUnit)
     item.storageLocation = data.get("storageLocation", item.storageLocation)
-    item.icon = data.get("icon", item.icon)
-
-    if item.icon and item.icon != "" and isinstance(item.icon, str):
+    if "icon" in data:
         try:
-            header, encoded = item.icon.split(",", 1)  # type: ignore
-        except ValueError:
-            return (
-                jsonify(
-                    {
-                        "error": "Ungültige Bilddaten: Das Bildformat konnte nicht verarbeitet werden."
-                    }
-                ),
-                400,
-            )
+            item.icon = store_media(data.get("icon"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        content_type = header.split(";")[0]
-        if content_type not in app.config["ALLOWED_CONTENT_TYPES"]:
-            return (
-                jsonify(
-                    {
-                        "error": "Ungültiges Bildformat: Es sind nur PNG-, JPG-, JPEG- oder GIF-Dateien erlaubt."
-                    }
-                ),
-                400,
-            )
+    log_change("item", [item.id], item.user_id)
+    bump_data_version(item.user_id)
+    commit_changes()
 
-        try:
-            image_data = base64.b64decode(encoded)
-        except Exception as e:
-            return jsonify({"error": "Fehler beim Dekodieren der Bilddaten."}), 400
+    item = get_inventory_item(item.id)
+    return jsonify(serialize_storage_item(item)), 200
 
-        if len(image_data) > 5 * 1024 * 1024:
-            return (
-                jsonify(
-                    {
-                        "error": "Die Bildgröße überschreitet das erlaubte Limit von 5 MB."
-                    }
-                ),
-                400,
-            )
 
-    db.session.commit()
-    return (
-        jsonify(
-            {
-                "id": item.id,
-                "name": item.name,
-                "amount": item.amount,
-                "categories": item.categories.split(",") if item.categories else [],
-                "lowestAmount": item.lowestAmount,
-                "midAmount": item.midAmount,
-                "unit": item.unit,
-                "packageQuantity": item.packageQuantity,
-                "packageUnit": item.packageUnit,
-                "storageLocation": item.storageLocation,
-                "icon": item.icon,
-                "nutrients": (
-                    {
-                        "id": item.nutrient.id,
-                        "description": item.nutrient.description,
-                        "unit": item.nutrient.unit,
-                        "amount": item.nutrient.amount,
-                        "values": [
-                            {
-                                "id": v.id,
-                                "name": v.name,
-                                "color": v.color,
-                                "values": [
-                                    {"typ": t.typ, "value": t.value} for t in v.values
-                                ],
-                            }
-                            for v in item.nutrient.values
-                        ],
-                    }
-                    if item.nutrient
-                    else None
-                ),
-            }
-        ),
-        200,
+@app.route("/items/<int:item_id>", methods=["PATCH"])
+@jwt_required()
+def patch_item_amount(item_id):
+    """Ändert den Bestand atomar um ``delta`` (nicht unter 0)"""
+    user_id = get_jwt_identity()
+    try:
+        delta = parse_amount_delta(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    row = apply_amount_delta(
+        StorageItem, item_id, delta, accessible_user_ids, minimum=0
     )
+    if row is None:
+        if db.session.get(StorageItem, item_id) is None:
+            return jsonify({"error": "Item not found"}), 404
+        return jsonify({"error": "Unauthorized"}), 403
+
+    log_change("item", [item_id], row.user_id)
+    bump_data_version(row.user_id)
+    commit_changes()
+
+    item = get_inventory_item(item_id)
+    return jsonify(serialize_storage_item(item)), 200
+
+
+@app.route("/items/<int:item_id>/icon", methods=["PUT"])
+@jwt_required()
+def upload_item_icon(item_id):
+    """Icon als Datei hochladen (multipart/form-data oder image/* Body)"""
+    user_id = get_jwt_identity()
+    item = get_inventory_item(item_id)
+    if not item:
+        return jsonify({"error": "Item not found"}), 404
+
+    accessible_user_ids = get_group_member_ids(int(user_id))
+    if item.user_id not in accessible_user_ids:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    ref, error = store_image_upload()
+    if error:
+        return error
+    item.icon = ref
+
+    log_change("item", [item.id], item.user_id)
+    bump_data_version(item.user_id)
+    db.session.commit()
+
+    item = get_inventory_item(item.id)
+    return jsonify(serialize_storage_item(item)), 200
 
 
 @app.route("/items/<int:item_id>", methods=["GET"])
 @jwt_required()
 def get_item(item_id):
     user_id = get_jwt_identity()
-    item = StorageItem.query.filter_by(id=item_id).first()
+    try:
+        fields = parse_fields(ITEM_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    item = get_inventory_item(item_id, fields)
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
@@ -2090,42 +4962,7 @@ def get_item(item_id):
     if item.user_id not in accessible_user_ids:
         return jsonify({"error": "Unauthorized"}), 403
     return (
-        jsonify(
-            {
-                "id": item.id,
-                "name": item.name,
-                "amount": item.amount,
-                "categories": item.categories.split(",") if item.categories else [],
-                "lowestAmount": item.lowestAmount,
-                "midAmount": item.midAmount,
-                "unit": item.unit,
-                "packageQuantity": item.packageQuantity,
-                "packageUnit": item.packageUnit,
-                "storageLocation": item.storageLocation,
-                "icon": item.icon,
-                "nutrients": (
-                    {
-                        "id": item.nutrient.id,
-                        "description": item.nutrient.description,
-                        "unit": item.nutrient.unit,
-                        "amount": item.nutrient.amount,
-                        "values": [
-                            {
-                                "id": v.id,
-                                "name": v.name,
-                                "color": v.color,
-                                "values": [
-                                    {"typ": t.typ, "value": t.value} for t in v.values
-                                ],
-                            }
-                            for v in item.nutrient.values
-                        ],
-                    }
-                    if item.nutrient
-                    else None
-                ),
-            }
-        ),
+        jsonify(serialize_storage_item(item, fields=fields)),
         200,
         {"Content-Type": "application/json"},
     )
@@ -2148,7 +4985,9 @@ def delete_item(item_id):
         )
 
     db.session.delete(item)
-    db.session.commit()
+    log_change("item", [item.id], item.user_id, op="delete")
+    bump_data_version(item.user_id)
+    commit_changes()
     return jsonify({"message": "Item deleted successfully"}), 200
 
 
@@ -2162,7 +5001,7 @@ def update_nutrients(item_id):
         return jsonify({"error": "Invalid input data"}), 400
 
     nutrient_data = data
-    item = StorageItem.query.filter_by(id=item_id).first()
+    item = get_inventory_item(item_id)
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
@@ -2211,44 +5050,13 @@ def update_nutrients(item_id):
             )
             db.session.add(nt)
 
-    db.session.commit()
+    log_change("item", [item.id], item.user_id)
+    bump_data_version(item.user_id)
+    commit_changes()
+
+    item = get_inventory_item(item.id)
     return (
-        jsonify(
-            {
-                "id": item.id,
-                "name": item.name,
-                "amount": item.amount,
-                "categories": item.categories.split(",") if item.categories else [],
-                "lowestAmount": item.lowestAmount,
-                "midAmount": item.midAmount,
-                "unit": item.unit,
-                "packageQuantity": item.packageQuantity,
-                "packageUnit": item.packageUnit,
-                "storageLocation": item.storageLocation,
-                "icon": item.icon,
-                "nutrients": (
-                    {
-                        "id": nutrient.id,
-                        "description": nutrient.description,
-                        "unit": nutrient.unit,
-                        "amount": nutrient.amount,
-                        "values": [
-                            {
-                                "id": v.id,
-                                "name": v.name,
-                                "color": v.color,
-                                "values": [
-                                    {"typ": t.typ, "value": t.value} for t in v.values
-                                ],
-                            }
-                            for v in item.nutrient.values
-                        ],
-                    }
-                    if item.nutrient
-                    else None
-                ),
-            }
-        ),
+        jsonify(serialize_storage_item(item)),
         200,
         {"Content-Type": "application/json"},
     )
@@ -2266,7 +5074,9 @@ def get_categories():
         .filter((Category.user_id == user_id) | (Category.user_id == default_user_id))
         .all()
     )
-    return jsonify([{"id": cat.id, "name": cat.name} for cat in categories]), 200
+    return content_etag_response(
+        [{"id": cat.id, "name": cat.name} for cat in categories]
+    )
 
 
 @app.route("/storage-locations", methods=["GET"])
@@ -2284,7 +5094,9 @@ def get_storage_locations():
         )
         .all()
     )
-    return jsonify([{"id": loc.id, "name": loc.name} for loc in locations]), 200
+    return content_etag_response(
+        [{"id": loc.id, "name": loc.name} for loc in locations]
+    )
 
 
 @app.route("/item-units", methods=["GET"])
@@ -2299,7 +5111,7 @@ def get_item_units():
         .filter((ItemUnit.user_id == user_id) | (ItemUnit.user_id == default_user_id))
         .all()
     )
-    return jsonify([{"id": unit.id, "name": unit.name} for unit in units]), 200
+    return content_etag_response([{"id": unit.id, "name": unit.name} for unit in units])
 
 
 @app.route("/package-units", methods=["GET"])
@@ -2316,9 +5128,8 @@ def get_package_units():
         )
         .all()
     )
-    return (
-        jsonify([{"id": package.id, "name": package.name} for package in packages]),
-        200,
+    return content_etag_response(
+        [{"id": package.id, "name": package.name} for package in packages]
     )
 
 
@@ -2337,24 +5148,194 @@ def get_nutrient_units():
         )
         .all()
     )
-    return (
-        jsonify([{"id": nutrient.id, "name": nutrient.name} for nutrient in nutrients]),
-        200,
+    return content_etag_response(
+        [{"id": nutrient.id, "name": nutrient.name} for nutrient in nutrients]
     )
 
 
-# function to search for an image of the item on bing
-def get_icon_from_serpapi(name):
+ICON_CACHE_TTL = timedelta(days=30)
+ICON_CACHE_NEGATIVE_TTL = timedelta(hours=6)
+ICON_LRU_SIZE = 1024
+ICON_LOOKUP_WORKERS = 8
+ICON_LOOKUP_TIMEOUT = 4  # Sekunden pro SerpAPI-Aufruf
+ICON_LOOKUP_DEADLINE = 8  # Sekunden für alle Aufrufe eines Requests
+_serpapi_client = serpapi.Client()
+_icon_lru: "OrderedDict[str, tuple]" = OrderedDict()
+_icon_lru_lock = threading.Lock()
+
+
+def normalize_icon_name(name: str) -> str:
+    return " ".join(name.split()).casefold()[:255]
+
+
+def search_icon_serpapi(name, timeout=None):
+    """Fragt SerpAPI nach einem Thumbnail; None bei Fehlern, "" wenn nichts gefunden"""
     params = {
         "engine": "google_images",
         "q": name,
         "api_key": os.getenv("SEARCH_API_KEY"),
     }
     try:
-        search = serpapi.search(params)
-        return search["images_results"][0].get("thumbnail")
-    except HTTPError as e:
-        return ""
+        response = _serpapi_client.request(
+            "GET", "/search", params=params, timeout=timeout
+        )
+        results = response.json().get("images_results") or []
+        return (results[0].get("thumbnail") or "") if results else ""
+    except Exception as e:
+        print(f"Icon-Suche für '{name}' fehlgeschlagen: {e}")
+        return None
+
+
+def _icon_lru_get(key: str):
+    with _icon_lru_lock:
+        entry = _icon_lru.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= datetime.now():
+            del _icon_lru[key]
+            return None
+        _icon_lru.move_to_end(key)
+        return entry
+
+
+def _icon_lru_put(key: str, icon: Optional[str], expires_at: datetime):
+    with _icon_lru_lock:
+        _icon_lru[key] = (icon, expires_at)
+        _icon_lru.move_to_end(key)
+        while len(_icon_lru) > ICON_LRU_SIZE:
+            _icon_lru.popitem(last=False)
+
+
+def cache_icon_lookup(name: str, icon: Optional[str]):
+    """Speichert ein Suchergebnis im Prozess-Cache und merkt es für icon_lookup vor.
+
+    Treffer leben ICON_CACHE_TTL, leere Ergebnisse und Fehler nur
+    ICON_CACHE_NEGATIVE_TTL. Die Zeile wird erst am Ende des App-Kontexts in
+    einer eigenen Transaktion geschrieben (persist_icon_lookups), damit ein
+    zurückgerollter Import die Suchergebnisse nicht verwirft.
+    """
+    key = normalize_icon_name(name)
+    icon = icon or None
+    ttl = ICON_CACHE_TTL if icon else ICON_CACHE_NEGATIVE_TTL
+    expires_at = datetime.now() + ttl
+    _icon_lru_put(key, icon, expires_at)
+    g.setdefault("icon_lookups", {})[key] = (icon, expires_at)
+
+
+def persist_icon_lookups():
+    """Schreibt vorgemerkte Suchergebnisse in icon_lookup und committet.
+
+    INSERT ... ON CONFLICT DO UPDATE, damit gleichzeitige Suchen nach
+    demselben Namen nicht am Primärschlüssel scheitern.
+    """
+    pending = g.pop("icon_lookups", None)
+    if not pending:
+        return
+    rows = [
+        {"name_key": key, "icon": icon, "expires_at": expires_at}
+        for key, (icon, expires_at) in pending.items()
+    ]
+    table = IconLookup.__table__
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        dialect = postgresql if dialect_name == "postgresql" else sqlite
+        statement = dialect.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.name_key],
+            set_={
+                "icon": statement.excluded.icon,
+                "expires_at": statement.excluded.expires_at,
+            },
+        )
+        db.session.execute(statement, rows)
+    else:
+        for row in rows:
+            db.session.merge(IconLookup(**row))
+    db.session.commit()
+
+
+@app.teardown_appcontext
+def _persist_icon_lookups(exception):
+    if "icon_lookups" not in g:
+        return
+    # Nicht committete Änderungen des Requests verwerfen (wie danach
+    # Flask-SQLAlchemy), die Suchergebnisse laufen in eigener Transaktion
+    db.session.remove()
+    try:
+        persist_icon_lookups()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Icon-Cache konnte nicht gespeichert werden: {e}")
+
+
+def get_cached_icon(name: str):
+    """Gibt ``(gefunden, icon)`` aus LRU bzw. icon_lookup zurück"""
+    key = normalize_icon_name(name)
+    entry = _icon_lru_get(key)
+    if entry is not None:
+        return True, entry[0] or ""
+    lookup = db.session.get(IconLookup, key)
+    if lookup is None or lookup.expires_at <= datetime.now():
+        return False, None
+    _icon_lru_put(key, lookup.icon, lookup.expires_at)
+    return True, lookup.icon or ""
+
+
+def resolve_icons(names) -> dict:
+    """Ermittelt Icons für mehrere Item-Namen, gibt ``{normalisierter_name: icon}`` zurück.
+
+    Gleiche Namen werden nur einmal gesucht, Cache-Treffer gar nicht. Die
+    übrigen Suchen laufen parallel mit Timeout pro Aufruf; was nach
+    ICON_LOOKUP_DEADLINE nicht beantwortet ist, fehlt im Ergebnis.
+    """
+    icons = {}
+    pending = {}
+    for name in names:
+        key = normalize_icon_name(name)
+        if key in icons or key in pending:
+            continue
+        entry = _icon_lru_get(key)
+        if entry is not None:
+            icons[key] = entry[0] or ""
+        else:
+            pending[key] = name
+
+    if pending:
+        now = datetime.now()
+        for lookup in IconLookup.query.filter(
+            IconLookup.name_key.in_(list(pending)), IconLookup.expires_at > now
+        ):
+            _icon_lru_put(lookup.name_key, lookup.icon, lookup.expires_at)
+            icons[lookup.name_key] = lookup.icon or ""
+            del pending[lookup.name_key]
+
+    if pending:
+        executor = ThreadPoolExecutor(
+            max_workers=min(ICON_LOOKUP_WORKERS, len(pending))
+        )
+        futures = {
+            executor.submit(search_icon_serpapi, name, ICON_LOOKUP_TIMEOUT): key
+            for key, name in pending.items()
+        }
+        done, _ = wait(futures, timeout=ICON_LOOKUP_DEADLINE)
+        # Hängende Suchen nicht abwarten, ihr Ergebnis wird verworfen
+        executor.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            key = futures[future]
+            icon = future.result()
+            cache_icon_lookup(pending[key], icon)
+            icons[key] = icon or ""
+    return icons
+
+
+# function to search for an image of the item on bing
+def get_icon_from_serpapi(name):
+    found, icon = get_cached_icon(name)
+    if found:
+        return icon
+    icon = search_icon_serpapi(name)
+    cache_icon_lookup(name, icon)
+    return icon or ""
 
 
 def get_icon_as_base64(filename):
@@ -2389,6 +5370,130 @@ def get_icon_as_base64(filename):
         return ""
 
 
+## BATCH ##
+@app.route("/batch", methods=["POST"])
+@jwt_required()
+def run_batch():
+    """Führt mehrere Item-/Basket-/Nährwert-Operationen in einer Transaktion aus.
+
+    Body: ``{"operations": [{"method": "PUT", "path": "/items/1", "body": {...}}]}``.
+    Die Operationen laufen nacheinander über die bestehenden Routen, am Ende
+    wird einmal committet. Schlägt eine Operation fehl, wird alles
+    zurückgerollt und ihr Fehler zurückgegeben.
+    """
+    data = request.get_json()
+    operations = data.get("operations") if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return (
+            jsonify({"error": f"At most {BATCH_MAX_OPERATIONS} operations allowed"}),
+            400,
+        )
+
+    adapter = app.url_map.bind("localhost")
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not isinstance(
+            operation.get("path"), str
+        ):
+            return jsonify({"error": f"Invalid operation at index {index}"}), 400
+        try:
+            endpoint, _ = adapter.match(
+                operation["path"].split("?", 1)[0],
+                method=operation.get("method", "GET").upper(),
+            )
+        except HTTPException:
+            endpoint = None
+        if endpoint not in BATCH_ENDPOINTS:
+            return (
+                jsonify(
+                    {"error": f"Operation at index {index} is not allowed in a batch"}
+                ),
+                400,
+            )
+
+    headers = {
+        key: value
+        for key, value in request.headers.items()
+        if key in ("Authorization", "Cookie")
+    }
+    results = []
+    g.in_batch = True
+    g.batch_member_ids = {}
+    try:
+        for index, operation in enumerate(operations):
+            builder = EnvironBuilder(
+                path=operation["path"],
+                method=operation.get("method", "GET").upper(),
+                json=operation.get("body"),
+                headers=headers,
+                base_url=request.host_url,
+            )
+            # Der Request-Kontext teilt App-Kontext, g und DB-Session mit /batch
+            with app.request_context(builder.get_environ()):
+                response = app.full_dispatch_request()
+            result = {
+                "status": response.status_code,
+                "body": response.get_json(silent=True),
+            }
+            results.append(result)
+            if response.status_code >= 400:
+                db.session.rollback()
+                return (
+                    jsonify(
+                        {
+                            "error": f"Operation at index {index} failed",
+                            "failedIndex": index,
+                            "results": results,
+                        }
+                    ),
+                    response.status_code,
+                )
+        db.session.commit()
+    finally:
+        g.pop("in_batch", None)
+        g.pop("batch_member_ids", None)
+    return jsonify({"results": results}), 200
+
+
+## MEDIA ##
+def media_response(blob: MediaBlob):
+    response = make_response(blob.data)
+    response.headers["Content-Type"] = blob.content_type
+    # Browser sollen den Typ nicht aus dem Inhalt raten (z.B. als HTML)
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.set_etag(blob.hash)
+    return response.make_conditional(request)
+
+
+@app.route("/media/<blob_hash>", methods=["GET"])
+def get_media(blob_hash):
+    """Liefert ein Bild aus dem Blob-Store; der Inhalt ändert sich nie"""
+    blob = db.session.get(MediaBlob, blob_hash)
+    if not blob:
+        return jsonify({"error": "Not Found"}), 404
+    return media_response(blob)
+
+
+@app.route("/media/<blob_hash>/<int:size>", methods=["GET"])
+def get_media_thumbnail(blob_hash, size):
+    """Liefert das Thumbnail eines Bildes in der angefragten Größe"""
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({"error": "Not Found"}), 404
+    variant = db.session.get(MediaVariant, (blob_hash, size))
+    if variant is None:
+        # Bilder aus der Zeit vor den Thumbnails werden beim ersten Abruf skaliert
+        blob = db.session.get(MediaBlob, blob_hash)
+        if not blob:
+            return jsonify({"error": "Not Found"}), 404
+        create_thumbnails(blob.hash, blob.data)
+        db.session.commit()
+        variant = db.session.get(MediaVariant, (blob_hash, size))
+    blob = db.session.get(MediaBlob, variant.variant_hash)
+    return media_response(blob)
+
+
 ## HEALTH CHECK ##
 @app.route("/health", methods=["GET"])
 def health_check():
@@ -2429,6 +5534,7 @@ if __name__ == "__main__":
 
             # Create tables
             db.create_all()
+            ensure_schema()
             print("Database tables created/verified")
 
         except Exception as e:
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Renderkosten pro E-Mail
+Vergleicht das frühere Rendern (render_template() mit Logo, das bei jeder
+E-Mail von der Platte gelesen und kodiert wird) mit render_mail(), das
+kompilierte Templates und das Logo einmal pro Prozess cached.
+
+Aufruf: python benchmark_mail_render.py [anzahl]
+"""
+
+import sys
+import timeit
+
+from flask import render_template
+
+from app import app, get_logo_base64, render_mail
+
+CONTEXT = {
+    "activation_url": "https://example.org/activate-account/token",
+    "username": "benchmark",
+}
+
+
+def render_uncached():
+    return render_template(
+        "activate_account_mail.html",
+        logo_base64=get_logo_base64.__wrapped__(),
+        current_year=2025,
+        **CONTEXT,
+    )
+
+
+def render_cached():
+    return render_mail("activate_account_mail.html", **CONTEXT)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with app.test_request_context():
+        # Warmlauf, damit beide Varianten mit geladener Jinja-Umgebung starten
+        render_uncached()
+        render_cached()
+
+        print(f"{'Variante':<30} {'µs pro E-Mail':>15}")
+        print("-" * 46)
+        for label, func in (
+            ("render_template + Logo lesen", render_uncached),
+            ("render_mail (gecacht)", render_cached),
+        ):
+            seconds = min(timeit.repeat(func, number=number, repeat=3))
+            print(f"{label:<30} {seconds / number * 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
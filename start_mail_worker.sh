@@ -0,0 +1,17 @@
+#!/bin/sh
+
+# Mail-Worker für die E-Mail-Outbox, läuft neben Gunicorn.
+# Wird nach einem Absturz automatisch neu gestartet.
+# Mit RUN_MAIL_WORKER=0 abschalten, wenn der Worker separat läuft.
+
+if [ "${RUN_MAIL_WORKER:-1}" = "0" ]; then
+    echo "Mail-Worker deaktiviert (RUN_MAIL_WORKER=0)"
+    exit 0
+fi
+
+while true; do
+    flask --app app mail-worker
+    status=$?
+    echo "Mail-Worker beendet (Exit-Code $status), Neustart in 5 Sekunden..."
+    sleep 5
+done
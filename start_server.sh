@@ -20,6 +20,12 @@ echo "Starting Prepper App with Gunicorn..."
 echo "Database URI: $DATABASE_URI"
 echo "Worker processes: 2"
 
+# Schema und Datenmigrationen (Indizes, Kategorien, Bilder) nachziehen
+flask ensure-schema || exit 1
+
+# Mail-Worker für die E-Mail-Outbox im Hintergrund starten
+sh ./start_mail_worker.sh &
+
 # Starte Gunicorn mit Konfigurationsdatei
 exec gunicorn \
     --config gunicorn.conf.py \
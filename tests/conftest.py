@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """Importiert app.py gegen eine leere SQLite-Datenbank"""
+    db_path = tmp_path_factory.mktemp("db") / "test.db"
+    os.environ["DATABASE_URI"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-with-enough-length")
+    # app.py lädt swagger.yaml relativ zum Arbeitsverzeichnis
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+
+    app_module.app.config["TESTING"] = True
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        app_module.ensure_schema()
+    return app_module
+
+
+@pytest.fixture
+def app_ctx(app_module):
+    with app_module.app.app_context():
+        yield app_module
+        app_module.db.session.rollback()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def make_user(app_ctx):
+    """Legt einen aktivierten User an und liefert ``(user, auth_header)``"""
+    from flask_jwt_extended import create_access_token
+
+    app = app_ctx
+    counter = iter(range(1_000_000))
+
+    def make(prefix="user"):
+        name = f"{prefix}{app.User.query.count()}_{next(counter)}"
+        user = app.User(username=name)
+        user.set_email(f"{name}@example.com")
+        user.set_password("passwort")
+        user.activated = True
+        app.db.session.add(user)
+        app.db.session.commit()
+        token = create_access_token(identity=str(user.id))
+        return user, {"Authorization": f"Bearer {token}"}
+
+    return make
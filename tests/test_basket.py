@@ -0,0 +1,92 @@
+def stock(app, user_id):
+    return {
+        item.name: (item.amount, item.name_key)
+        for item in app.StorageItem.query.filter_by(user_id=user_id)
+    }
+
+
+def test_checkout_matches_names_case_insensitively(app_ctx, client, make_user):
+    app = app_ctx
+    user, headers = make_user()
+    response = client.post(
+        "/items/bulk",
+        json=[
+            {
+                "name": "Äpfel",
+                "amount": 1,
+                "unit": "Stück",
+                "storageLocation": "Keller",
+                "lowestAmount": 0,
+                "midAmount": 1,
+                "icon": "https://img/apfel.png",
+            }
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 201
+    for name in ("äpfel ", "Straße"):
+        assert (
+            client.post("/basket", json={"name": name}, headers=headers).status_code
+            == 201
+        )
+
+    response = client.post(
+        "/basket/checkout", json={"storageLocation": "Keller"}, headers=headers
+    )
+    assert response.status_code == 200, response.get_json()
+
+    app.db.session.expire_all()
+    assert stock(app, user.id) == {
+        "Äpfel": (2, "äpfel"),
+        "Straße": (1, "strasse"),
+    }
+
+    # Ein weiterer Checkout findet das neue Item über name_key
+    client.post("/basket", json={"name": "STRASSE"}, headers=headers)
+    response = client.post(
+        "/basket/checkout", json={"storageLocation": "Keller"}, headers=headers
+    )
+    assert response.status_code == 200
+    app.db.session.expire_all()
+    assert stock(app, user.id)["Straße"] == (2, "strasse")
+
+
+def test_rename_updates_name_key(app_ctx, client, make_user):
+    app = app_ctx
+    user, headers = make_user()
+    response = client.post(
+        "/items",
+        json={
+            "name": "Mehl",
+            "amount": 1,
+            "unit": "kg",
+            "storageLocation": "Keller",
+            "lowestAmount": 0,
+            "midAmount": 1,
+            "icon": "https://img/mehl.png",
+        },
+        headers=headers,
+    )
+    item_id = response.get_json()["id"]
+    assert app.db.session.get(app.StorageItem, item_id).name_key == "mehl"
+
+    response = client.put(
+        f"/items/{item_id}", json={"name": "Weizenmehl"}, headers=headers
+    )
+    assert response.status_code == 200
+    app.db.session.expire_all()
+    assert app.db.session.get(app.StorageItem, item_id).name_key == "weizenmehl"
+
+
+def test_update_basket_item_requires_name(app_ctx, client, make_user):
+    _, headers = make_user()
+    item = client.post("/basket", json={"name": "Milch"}, headers=headers).get_json()
+
+    response = client.put(f"/basket/{item['id']}", json={"amount": 3}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.put(
+        f"/basket/{item['id']}", json={"name": "Milch", "amount": 3}, headers=headers
+    )
+    assert response.status_code == 201
+    assert response.get_json()["amount"] == 3
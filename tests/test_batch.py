@@ -0,0 +1,18 @@
+def test_membership_change_clears_batch_member_cache(app_ctx, make_user):
+    app = app_ctx
+    alice, _ = make_user()
+    bob, _ = make_user()
+    group = app.Group(name="Familie", description="", created_by=alice.id)
+    app.db.session.add(group)
+    app.db.session.flush()
+    app.db.session.add(app.UserGroup(alice.id, group.id, "admin"))
+    app.db.session.commit()
+
+    with app.app.test_request_context():
+        app.g.batch_member_ids = {}
+        assert app.get_group_member_ids(alice.id) == [alice.id]
+
+        app.db.session.add(app.UserGroup(bob.id, group.id))
+        app.log_membership_change(alice.id, bob.id)
+        assert sorted(app.get_group_member_ids(alice.id)) == sorted([alice.id, bob.id])
+    app.db.session.rollback()
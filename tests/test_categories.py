@@ -0,0 +1,81 @@
+def create_item(client, headers, name, categories):
+    response = client.post(
+        "/items",
+        json={
+            "name": name,
+            "amount": 2,
+            "unit": "Stück",
+            "storageLocation": "Keller",
+            "lowestAmount": 1,
+            "midAmount": 2,
+            "categories": categories,
+            "icon": "https://img/item.png",
+        },
+        headers=headers,
+    )
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def test_free_text_categories_are_linked_and_filterable(app_ctx, client, make_user):
+    user, headers = make_user()
+    label = f"Vorrat-{user.id}"
+
+    created = create_item(client, headers, "Reis", [label, " " + label])
+    assert created["categories"] == [label]
+
+    response = client.get(f"/items?category={label}", headers=headers)
+    assert [item["name"] for item in response.get_json()] == ["Reis"]
+
+    names = [
+        category["name"]
+        for category in client.get("/categories", headers=headers).get_json()
+    ]
+    assert label in names
+
+
+def test_same_label_from_two_users_shares_one_category(app_ctx, client, make_user):
+    app = app_ctx
+    _, headers_a = make_user()
+    _, headers_b = make_user()
+    label = f"Geteilt-{app.User.query.count()}"
+
+    create_item(client, headers_a, "Nudeln", [label])
+    created = create_item(client, headers_b, "Nudeln", [label])
+    assert created["categories"] == [label]
+    assert app.Category.query.filter_by(name=label).count() == 1
+
+
+def test_category_migration_runs_once(app_ctx, make_user):
+    app = app_ctx
+    user, _ = make_user()
+    label = f"Alt-{user.id}"
+    app.db.session.add(
+        app.StorageItem(
+            name="Linsen",
+            amount=1,
+            categories=label,
+            lowestAmount=0,
+            midAmount=1,
+            unit="kg",
+            packageQuantity=None,
+            packageUnit=None,
+            storageLocation="Keller",
+            icon=None,
+            user_id=user.id,
+        )
+    )
+    app.db.session.query(app.SchemaMigration).filter_by(name="item_categories").delete()
+    app.db.session.commit()
+
+    app.migrate_item_categories()
+    item = app.StorageItem.query.filter_by(user_id=user.id, name="Linsen").one()
+    assert [category.name for category in item.linked_categories] == [label]
+    assert app.db.session.get(app.SchemaMigration, "item_categories") is not None
+
+    # Mit Marker wird nichts mehr gelesen oder verknüpft
+    app.db.session.execute(app.storage_item_category.delete())
+    app.db.session.commit()
+    app.migrate_item_categories()
+    app.db.session.expire_all()
+    assert item.linked_categories == []
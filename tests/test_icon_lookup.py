@@ -0,0 +1,102 @@
+import threading
+
+
+class StubSerpApiClient:
+    """Zählt Suchanfragen statt SerpAPI aufzurufen"""
+
+    def __init__(self, thumbnails):
+        self.thumbnails = thumbnails
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def request(self, method, path, params=None, timeout=None):
+        with self.lock:
+            self.queries.append(params["q"])
+        thumbnail = self.thumbnails.get(params["q"])
+        return StubResponse(
+            {"images_results": [{"thumbnail": thumbnail}] if thumbnail else []}
+        )
+
+
+class StubResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def reset_icon_cache(app):
+    app._icon_lru.clear()
+    app.IconLookup.query.delete()
+    app.db.session.commit()
+
+
+def test_get_icon_searches_once_per_cache_miss(app_ctx, monkeypatch):
+    app = app_ctx
+    reset_icon_cache(app)
+    stub = StubSerpApiClient({"Milch": "https://img/milch.png"})
+    monkeypatch.setattr(app, "_serpapi_client", stub)
+
+    assert app.get_icon_from_serpapi("Milch") == "https://img/milch.png"
+    assert app.get_icon_from_serpapi("Milch") == "https://img/milch.png"
+    assert app.get_icon_from_serpapi("Quark") == ""
+    assert app.get_icon_from_serpapi("Quark") == ""
+    assert stub.queries == ["Milch", "Quark"]
+
+    # Ohne Prozess-Cache kommt der Treffer aus icon_lookup
+    app.persist_icon_lookups()
+    app._icon_lru.clear()
+    assert app.get_icon_from_serpapi("Milch") == "https://img/milch.png"
+    assert stub.queries == ["Milch", "Quark"]
+
+
+def test_resolve_icons_deduplicates_names(app_ctx, monkeypatch):
+    app = app_ctx
+    reset_icon_cache(app)
+    stub = StubSerpApiClient({"Brot": "https://img/brot.png"})
+    monkeypatch.setattr(app, "_serpapi_client", stub)
+
+    icons = app.resolve_icons(["Brot", "brot", "Käse", "Brot"])
+    assert icons == {
+        app.normalize_icon_name("Brot"): "https://img/brot.png",
+        app.normalize_icon_name("Käse"): "",
+    }
+    assert sorted(stub.queries) == ["Brot", "Käse"]
+
+    app.resolve_icons(["Brot", "Käse"])
+    assert len(stub.queries) == 2
+
+
+def test_lookups_are_kept_when_import_rolls_back(app_module, client, monkeypatch):
+    app = app_module
+    from flask_jwt_extended import create_access_token
+
+    with app.app.app_context():
+        reset_icon_cache(app)
+        user = app.User(username="icon_rollback")
+        user.set_email("icon_rollback@example.com")
+        user.set_password("passwort")
+        user.activated = True
+        app.db.session.add(user)
+        app.db.session.commit()
+        headers = {"Authorization": f"Bearer {create_access_token(str(user.id))}"}
+    stub = StubSerpApiClient({"Honig": "https://img/honig.png"})
+    monkeypatch.setattr(app, "_serpapi_client", stub)
+
+    honey = {
+        "name": "Honig",
+        "amount": 1,
+        "unit": "Glas",
+        "storageLocation": "Keller",
+        "lowestAmount": 0,
+        "midAmount": 1,
+    }
+    # Doppeltes Item: der Insert scheitert nach der Icon-Suche mit 409
+    response = client.post("/items/bulk", json=[honey, honey], headers=headers)
+    assert response.status_code == 409
+    assert stub.queries == ["Honig"]
+
+    with app.app.app_context():
+        lookup = app.db.session.get(app.IconLookup, app.normalize_icon_name("Honig"))
+        assert lookup is not None and lookup.icon == "https://img/honig.png"
@@ -0,0 +1,91 @@
+import json
+
+
+def item(name, **extra):
+    data = {
+        "name": name,
+        "amount": 5,
+        "unit": "Stück",
+        "storageLocation": "Keller",
+        "lowestAmount": 1,
+        "midAmount": 3,
+    }
+    data.update(extra)
+    return data
+
+
+def stored_item(app, user_id, name):
+    row = app.StorageItem.query.filter_by(user_id=user_id, name=name).one()
+    linked = app.db.session.execute(
+        app.db.select(app.Category.name)
+        .join(
+            app.storage_item_category,
+            app.storage_item_category.c.category_id == app.Category.id,
+        )
+        .where(app.storage_item_category.c.storage_item_id == row.id)
+    ).scalars()
+    return row, sorted(linked)
+
+
+def test_bulk_upsert_keeps_omitted_optional_fields(app_ctx, client, make_user):
+    app = app_ctx
+    user, headers = make_user()
+    category = f"Obst-{user.id}"
+    app.db.session.add(app.Category(category, user.id))
+    app.db.session.commit()
+
+    full = item(
+        "Apfel",
+        categories=[category],
+        packageQuantity=6,
+        packageUnit="Netz",
+        icon="https://img/apfel.png",
+    )
+    response = client.post("/items/bulk", json=[full], headers=headers)
+    assert response.status_code == 201
+
+    response = client.post(
+        "/items/bulk?mode=upsert", json=[item("Apfel", amount=9)], headers=headers
+    )
+    assert response.status_code == 200
+
+    app.db.session.expire_all()
+    row, linked = stored_item(app, user.id, "Apfel")
+    assert row.amount == 9
+    assert row.categories == category
+    assert linked == [category]
+    assert (row.packageQuantity, row.packageUnit) == (6, "Netz")
+    assert row.icon == "https://img/apfel.png"
+
+
+def test_ndjson_upsert_keeps_omitted_optional_fields(app_ctx, client, make_user):
+    app = app_ctx
+    user, headers = make_user()
+    category = f"Gemüse-{user.id}"
+    app.db.session.add(app.Category(category, user.id))
+    app.db.session.commit()
+
+    def import_lines(*items):
+        body = "\n".join(json.dumps(data) for data in items)
+        return client.post(
+            "/items/import?mode=upsert",
+            data=body,
+            content_type="application/x-ndjson",
+            headers=headers,
+        )
+
+    full = item("Karotte", categories=[category], packageQuantity=1, packageUnit="kg")
+    assert import_lines(full).get_json()["imported"] == 1
+    assert import_lines(item("Karotte", amount=2)).get_json()["imported"] == 1
+
+    app.db.session.expire_all()
+    row, linked = stored_item(app, user.id, "Karotte")
+    assert row.amount == 2
+    assert linked == [category]
+    assert (row.packageQuantity, row.packageUnit) == (1, "kg")
+
+    # Mitgeschickte Kategorien ersetzen die bestehenden weiterhin
+    assert import_lines(item("Karotte", categories=[])).get_json()["imported"] == 1
+    app.db.session.expire_all()
+    row, linked = stored_item(app, user.id, "Karotte")
+    assert linked == []
@@ -0,0 +1,31 @@
+def test_low_stock_rejects_ok_status(app_ctx, client, make_user):
+    _, headers = make_user()
+    response = client.post(
+        "/items/bulk",
+        json=[
+            {
+                "name": name,
+                "amount": amount,
+                "unit": "Stück",
+                "storageLocation": "Keller",
+                "lowestAmount": 1,
+                "midAmount": 3,
+                "icon": "https://img/item.png",
+            }
+            for name, amount in (("Leer", 0), ("Knapp", 2), ("Voll", 9))
+        ],
+        headers=headers,
+    )
+    assert response.status_code == 201
+
+    response = client.get("/items/low-stock", headers=headers)
+    assert [(item["name"], item["status"]) for item in response.get_json()] == [
+        ("Leer", "low"),
+        ("Knapp", "mid"),
+    ]
+    response = client.get("/items/low-stock?status=low", headers=headers)
+    assert [item["name"] for item in response.get_json()] == ["Leer"]
+
+    for status in ("ok", "low,ok", "empty"):
+        response = client.get(f"/items/low-stock?status={status}", headers=headers)
+        assert response.status_code == 400
@@ -0,0 +1,86 @@
+import smtplib
+
+import pytest
+
+
+class StubSMTP:
+    """Ersetzt smtplib.SMTP_SSL und protokolliert Logins und Sendungen"""
+
+    instances = []
+
+    def __init__(self, host, port, context=None, timeout=None):
+        self.logins = 0
+        self.sent = []
+        self.closed = False
+        self.disconnect_next = False
+        StubSMTP.instances.append(self)
+
+    def login(self, user, password):
+        self.logins += 1
+
+    def send_message(self, msg):
+        if self.disconnect_next:
+            self.disconnect_next = False
+            raise smtplib.SMTPServerDisconnected("Verbindung getrennt")
+        self.sent.append(msg["To"])
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def transport(app_ctx, monkeypatch):
+    app = app_ctx
+    StubSMTP.instances = []
+    monkeypatch.setattr(app.smtplib, "SMTP_SSL", StubSMTP)
+    transport = app.SMTPTransport()
+    monkeypatch.setattr(app, "mail_transport", transport)
+    app.EmailOutbox.query.delete()
+    app.db.session.commit()
+    yield transport
+    transport.close()
+
+
+def queue_emails(app, count):
+    for i in range(count):
+        app.queue_email(f"user{i}@example.com", "Betreff", "<p>Hallo</p>")
+    app.db.session.commit()
+
+
+def test_worker_batch_logs_in_once(app_ctx, transport):
+    app = app_ctx
+    queue_emails(app, 5)
+
+    assert app.deliver_outbox() == 5
+    assert len(StubSMTP.instances) == 1
+    server = StubSMTP.instances[0]
+    assert server.logins == 1
+    assert len(server.sent) == 5
+    statuses = {message.status for message in app.EmailOutbox.query}
+    assert statuses == {"sent"}
+
+    # Der nächste Stapel nutzt die offene Verbindung weiter
+    queue_emails(app, 2)
+    assert app.deliver_outbox() == 2
+    assert len(StubSMTP.instances) == 1
+    assert server.logins == 1
+
+
+def test_worker_reconnects_once_after_disconnect(app_ctx, transport):
+    app = app_ctx
+    queue_emails(app, 1)
+    assert app.deliver_outbox() == 1
+
+    StubSMTP.instances[0].disconnect_next = True
+    queue_emails(app, 3)
+    assert app.deliver_outbox() == 3
+    assert len(StubSMTP.instances) == 2
+    assert [server.logins for server in StubSMTP.instances] == [1, 1]
+    assert len(StubSMTP.instances[1].sent) == 3
+    assert app.EmailOutbox.query.filter_by(status="sent").count() == 4
@@ -0,0 +1,44 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+
+def png_bytes():
+    output = io.BytesIO()
+    Image.new("RGB", (4, 4), "red").save(output, "PNG")
+    return output.getvalue()
+
+
+def data_url(content_type, data):
+    return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+
+
+def test_blob_uses_detected_type_and_nosniff(app_ctx, client):
+    app = app_ctx
+    ref = app.store_media(data_url("image/gif", png_bytes()))
+    app.db.session.commit()
+    blob = app.db.session.get(app.MediaBlob, ref[len(app.MEDIA_PREFIX) :])
+    assert blob.content_type == "image/png"
+
+    response = client.get(ref)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"<html><script>alert(1)</script></html>",
+        b"\x89PNG\r\n\x1a\n" + b"kein Bild" * 10,
+    ],
+)
+def test_invalid_image_bytes_are_rejected(app_ctx, data):
+    with pytest.raises(ValueError):
+        app_ctx.store_media(data_url("image/png", data))
+
+
+def test_default_icon_is_a_valid_image(app_ctx):
+    assert app_ctx.default_icon_ref().startswith(app_ctx.MEDIA_PREFIX)